@@ -16,15 +16,35 @@ JWT工作原理：
 @author: lixiang
 @date: 2025-11-20
 """
-from datetime import datetime, timedelta
-from typing import Optional
-from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from datetime import timedelta
+from typing import Dict, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import threading
+import time
+import orjson
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+import jwt
+from jwt import InvalidTokenError
+from jwt.api_jws import PyJWS
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from sqlalchemy import bindparam, inspect
+from sqlalchemy.orm import defer, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from sqlmodel import Session, select
 from db.database import get_session
 from db.models import User
 
+# 模块级日志记录器
+# 使用%格式化的参数是惰性求值的：日志级别未开启时不会格式化字符串，也不会产生I/O
+logger = logging.getLogger(__name__)
+
 # ==================== JWT配置 ====================
 
 # JWT密钥（用于签名和验证token）
@@ -32,17 +52,127 @@ from db.models import User
 # 如果密钥泄露，任何人都可以伪造token
 SECRET_KEY = "your-secret-key-change-in-production"
 
+# 预先编码好的密钥字节串，避免每次签名/验签时重复编码
+SECRET_KEY_BYTES = SECRET_KEY.encode("utf-8")
+
 # JWT算法（HS256是常用的对称加密算法）
 ALGORITHM = "HS256"
 
+# 验签时允许的算法列表（模块级常量，避免每次decode都新建一个列表）
+ALGORITHMS = [ALGORITHM]
+
 # Token过期时间（分钟）
 # 30 * 24 * 60 = 43200分钟 = 30天
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 24 * 60
 
+# JWS签名对象
+# PyJWT的jwt.encode内部固定使用标准库json处理payload，
+# 签发token时直接使用其下层的PyJWS对orjson序列化好的payload签名（C实现，比标准库json快数倍）
+# 验签统一使用PyJWT的jwt.decode（校验alg、签名、exp/nbf），验证通过的结果由下面的缓存复用
+_jws = PyJWS()
+
+# 验签时要求token必须带有exp（本服务签发的token都有），没有过期时间的token一律拒绝
+JWT_DECODE_OPTIONS = {"require": ["exp"]}
+
 # HTTPBearer：用于从请求头中提取Bearer token
 # Bearer是HTTP认证方案的一种，格式：Authorization: Bearer <token>
 security = HTTPBearer()
 
+# 可选版本：未携带token时不报错，返回None（供get_current_user_optional使用）
+security_optional = HTTPBearer(auto_error=False)
+
+# token最大长度：正常签发的token只有一两百字节，超长的输入直接拒绝，限制最坏情况下的处理开销
+TOKEN_MAX_LENGTH = 8192
+
+# ==================== Token验证缓存 ====================
+# 同一个token在30天有效期内会被反复使用，每次都做HMAC验签和JSON解析是浪费
+# 这里缓存已验证通过的payload：key为token的blake2b摘要（不保存原始token），
+# value为(payload, exp)，命中时只需检查是否过期
+# 缓存有上限，超出后按插入顺序（FIFO）淘汰最早的条目
+# 
+# 有效期上限：
+# - 缓存条目的有效期就是token自身的exp，命中时同样检查是否过期，已过期的条目直接删除并拒绝；
+#   缓存不会让任何token在exp之后继续被接受，也不会接受jwt.decode会拒绝的token（只缓存验证通过的结果）
+# - 本服务的token是无状态的，没有吊销列表（退出登录只在前端删除token），
+#   即使没有缓存，已签发的token在exp之前也一直有效；缓存不会在此之外增加新的“过期窗口”
+# - 缓存在进程内，各worker之间不共享，也就不存在跨进程的失效问题；唯一需要主动失效的情况是更换SECRET_KEY
+#   （SECRET_KEY是代码中的常量，更换需要重新部署，进程重启后缓存自然清空；进程内更换时调用clear_token_cache）
+# - 用户被修改/删除后的可见性由用户缓存决定，见下方“用户缓存”（最多USER_CACHE_TTL_SECONDS秒）
+
+# 缓存最大条目数
+TOKEN_CACHE_MAX_SIZE = 4096
+
+_token_cache: Dict[bytes, Tuple[dict, float]] = {}
+_token_cache_lock = threading.Lock()
+
+
+def _token_cache_key(token: str) -> bytes:
+    """计算token的缓存key（16字节blake2b摘要）"""
+    return hashlib.blake2b(token.encode("utf-8"), digest_size=16).digest()
+
+
+def clear_token_cache() -> None:
+    """
+    清空token验证缓存
+
+    注意：更换SECRET_KEY后必须调用，否则旧密钥签发的token仍会命中缓存
+    """
+    with _token_cache_lock:
+        _token_cache.clear()
+
+
+# ==================== 密码哈希 ====================
+# 数据库中只保存密码的argon2id哈希，不保存明文
+# argon2是刻意设计得很慢的哈希算法（每次几十毫秒），只在注册和登录时计算；
+# 登录后的请求只验证JWT，不会再次计算密码哈希，也不缓存密码验证结果
+
+_password_hasher = PasswordHasher()
+
+# argon2哈希的前缀，用于区分历史遗留的明文密码
+_ARGON2_PREFIX = "$argon2"
+
+# 用户不存在时用于比对的哈希，保证“用户不存在”和“密码错误”耗时一致，避免用户名被枚举
+_DUMMY_PASSWORD_HASH = _password_hasher.hash("dummy-password")
+
+
+def hash_password(password: str) -> str:
+    """计算密码的argon2id哈希（注册、修改密码时使用）"""
+    return _password_hasher.hash(password)
+
+
+def verify_password(password: str, stored: Optional[str]) -> bool:
+    """
+    验证密码是否正确
+
+    参数：
+    - password: 用户提交的明文密码
+    - stored: 数据库中保存的密码（argon2哈希；旧数据可能是明文）；用户不存在时传None
+
+    返回：
+    - 密码正确返回True，否则返回False
+    """
+    if stored is None:
+        # 用户不存在：仍然做一次哈希比对，使耗时与密码错误时一致
+        try:
+            _password_hasher.verify(_DUMMY_PASSWORD_HASH, password)
+        except VerificationError:
+            pass
+        return False
+    if not stored.startswith(_ARGON2_PREFIX):
+        # 历史遗留的明文密码：恒定时间比较，登录成功后会自动升级为哈希
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    try:
+        return _password_hasher.verify(stored, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+def password_needs_rehash(stored: str) -> bool:
+    """判断已保存的密码是否需要重新哈希（明文旧数据，或哈希参数已过时）"""
+    if not stored.startswith(_ARGON2_PREFIX):
+        return True
+    return _password_hasher.check_needs_rehash(stored)
+
 
 # ==================== Token生成和验证 ====================
 
@@ -74,21 +204,37 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None)->
     # 设置过期时间
     if expires_delta:
         # 如果提供了自定义过期时间，使用它
-        expire = datetime.utcnow() + expires_delta
+        expire_seconds = expires_delta.total_seconds()
     else:
         # 否则使用默认的过期时间（30天）
-        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire_seconds = ACCESS_TOKEN_EXPIRE_MINUTES * 60
     
     # 添加过期时间到数据中
     # exp是JWT标准字段，表示过期时间（Unix时间戳）
-    to_encode.update({"exp": expire})
+    # 直接在当前Unix时间戳上加秒数，不需要构建datetime再转换回时间戳（也不涉及时区）
+    to_encode.update({"exp": int(time.time() + expire_seconds)})
     
-    # 使用密钥和算法编码生成token
-    # jwt.encode(): 将数据编码为JWT token字符串
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # 使用orjson序列化payload，再用密钥和算法签名生成token
+    encoded_jwt = _jws.encode(orjson.dumps(to_encode), SECRET_KEY_BYTES, algorithm=ALGORITHM)
     return encoded_jwt
 
 
+def _unverified_exp(token: str) -> Optional[float]:
+    """
+    从token的payload段中读取exp（不验签），读取失败或exp不是数字时返回None
+    
+    结果未经签名验证，不可信：只能用来提前拒绝已过期的token，不能作为接受token的依据
+    """
+    try:
+        segment = token.split(".", 2)[1]
+        exp = orjson.loads(base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4)))["exp"]
+    except (ValueError, TypeError, KeyError, IndexError, binascii.Error):
+        return None
+    if isinstance(exp, bool) or not isinstance(exp, (int, float)):
+        return None
+    return float(exp)
+
+
 def verify_token(token: str) -> Optional[dict]:
     """
     验证JWT token
@@ -108,25 +254,157 @@ def verify_token(token: str) -> Optional[dict]:
     if payload:
         user_id = payload.get("sub")  # 获取用户ID
     """
+    # 格式快速检查：JWT必须是"."分隔的三段（只含ASCII字符），且长度有上限
+    # 爬虫/扫描器发来的垃圾token在这里就被拒绝，不会进入缓存查询和验签
+    if token.count(".") != 2 or len(token) > TOKEN_MAX_LENGTH or not token.isascii():
+        return None
+
+    # 先查缓存：命中且未过期则直接返回，跳过验签
+    cache_key = _token_cache_key(token)
+    cached = _token_cache.get(cache_key)
+    if cached is not None:
+        cached_payload, cached_exp = cached
+        if cached_exp > time.time():
+            return cached_payload
+        # 已过期，从缓存中移除
+        with _token_cache_lock:
+            _token_cache.pop(cache_key, None)
+
+    # 验签前先看exp：已过期的token不需要计算HMAC，直接拒绝（过期token是最常见的无效token）
+    # 这里读到的exp未经验证，只用于拒绝；没有过期或读取失败时仍由下面的jwt.decode完整验证
+    exp = _unverified_exp(token)
+    if exp is not None and exp <= time.time():
+        logger.debug("Token验证失败: token已过期")
+        return None
+
     try:
         # 解码并验证token
-        # jwt.decode(): 
-        # - 验证签名是否正确
-        # - 验证是否过期
+        # jwt.decode():
+        # - 验证alg是否在允许的列表中、签名是否正确
+        # - 验证是否过期（exp）、是否已生效（nbf），并要求必须带有exp
         # - 如果都通过，返回解码后的数据
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        print(f"Token验证成功: user_id={payload.get('sub')}")
-        return payload
-    except JWTError as e:
-        # token无效（过期、签名错误等）
+        payload = jwt.decode(token, SECRET_KEY_BYTES, algorithms=ALGORITHMS, options=JWT_DECODE_OPTIONS)
+    except InvalidTokenError as e:
+        # token无效（过期、签名错误、格式错误等）
         # 返回None表示验证失败
-        print(f"Token验证失败: {type(e).__name__}: {str(e)}")
+        logger.debug("Token验证失败: %s: %s", type(e).__name__, e)
         return None
+    logger.debug("Token验证成功: user_id=%s", payload.get("sub"))
+
+    with _token_cache_lock:
+        if len(_token_cache) >= TOKEN_CACHE_MAX_SIZE:
+            # dict保持插入顺序，第一个key就是最早插入的条目
+            _token_cache.pop(next(iter(_token_cache)), None)
+        _token_cache[cache_key] = (payload, float(payload["exp"]))
+    return payload
 
 
 # ==================== 用户认证依赖 ====================
 
-async def get_current_user(
+# 用户资料中只有个人信息接口才会用到的字段
+# 认证时延迟加载（defer），每个请求的用户查询只读取常用的窄列；
+# 需要这些字段的接口调用load_user_profile一次性补齐
+USER_PROFILE_FIELDS = ("email", "phone", "bio", "location", "website")
+
+# 按ID查询用户的语句，模块加载时构建一次，每次认证只绑定参数uid
+# SQLAlchemy会复用该语句的编译缓存；使用psycopg3等支持服务端预编译的驱动时，
+# 数据库也会缓存执行计划
+_GET_USER_STMT = (
+    select(User)
+    .options(*(defer(getattr(User, field)) for field in USER_PROFILE_FIELDS))
+    .where(User.id == bindparam("uid"))
+)
+
+
+# ==================== 用户缓存 ====================
+# 每个登录请求都要按ID查询一次用户，这里在进程内缓存查询结果，命中时不访问数据库
+# 
+# 缓存的是用户行的列值（不是ORM对象本身）：ORM对象绑定在某个会话上，不能跨请求/线程共享，
+# 命中时用缓存的列值为当前会话重新构建一个对象，之后修改、提交都和正常查询出来的对象一样
+# 
+# 一致性：
+# - 本进程内修改用户信息后调用invalidate_user_cache立即失效
+# - 其他进程（多worker）最多在USER_CACHE_TTL_SECONDS秒后过期重新查询：
+#   这段时间内其他worker可能仍使用旧的用户资料（昵称、头像等），
+#   已删除的用户持有的未过期token在这些worker上也仍能通过认证（最多USER_CACHE_TTL_SECONDS秒）
+
+# 缓存有效期（秒）
+USER_CACHE_TTL_SECONDS = 60
+
+# 缓存最大条目数（超出后按插入顺序淘汰）
+USER_CACHE_MAX_SIZE = 10000
+
+_user_cache: Dict[int, Tuple[dict, float]] = {}
+_user_cache_lock = threading.Lock()
+
+
+def invalidate_user_cache(user_id: int) -> None:
+    """用户信息被修改后调用，使该用户的缓存失效"""
+    with _user_cache_lock:
+        _user_cache.pop(user_id, None)
+
+
+def _restore_cached_user(session: Session, user_id: int, values: dict) -> User:
+    """用缓存的列值构建用户对象，并作为已持久化对象加入当前会话（不查询数据库）"""
+    # 当前会话中已经有这个用户，直接复用（同一会话中同一行只能对应一个对象）
+    existing = session.identity_map.get(identity_key(User, user_id))
+    if existing is not None:
+        return existing
+    user = User.__mapper__.class_manager.new_instance()
+    for key, value in values.items():
+        # 作为“已从数据库加载”的值设置，不会被当作修改
+        set_committed_value(user, key, value)
+    make_transient_to_detached(user)
+    session.add(user)
+    return user
+
+
+def _load_user(session: Session, user_id: int) -> Optional[User]:
+    """根据用户ID查询用户（优先使用缓存），不存在时返回None"""
+    cached = _user_cache.get(user_id)
+    if cached is not None and cached[1] > time.time():
+        return _restore_cached_user(session, user_id, cached[0])
+
+    user = session.execute(_GET_USER_STMT, {"uid": user_id}).scalar_one_or_none()
+    if user is None:
+        return None
+
+    # 只缓存已加载的列（认证时延迟加载的资料字段不在其中）
+    state = inspect(user)
+    values = {attr.key: state.dict[attr.key] for attr in state.mapper.column_attrs if attr.key in state.dict}
+    with _user_cache_lock:
+        if len(_user_cache) >= USER_CACHE_MAX_SIZE and user_id not in _user_cache:
+            _user_cache.pop(next(iter(_user_cache)), None)
+        _user_cache[user_id] = (values, time.time() + USER_CACHE_TTL_SECONDS)
+    return user
+
+
+def load_user_profile(session: Session, user: User) -> None:
+    """
+    加载认证时延迟的用户资料字段（email、phone、bio等）
+
+    一条SELECT补齐所有资料字段；不调用的话，逐个访问这些字段会各自触发一次查询
+    """
+    session.refresh(user, attribute_names=list(USER_PROFILE_FIELDS))
+
+
+# request.state 上缓存当前用户的属性名，值为 (token, User)
+# request.state 只在单个请求内有效，请求结束后自动丢弃，不需要手动清理
+_REQUEST_USER_ATTR = "auth_user"
+
+
+def _get_request_cached_user(request: Request, token: str) -> Optional[User]:
+    """读取本次请求中已经查询过的用户（token必须一致）"""
+    cached = getattr(request.state, _REQUEST_USER_ATTR, None)
+    # 使用恒定时间比较，避免通过比较耗时推测token内容
+    # （compare_digest只接受ASCII字符串；合法token一定是ASCII）
+    if cached is not None and token.isascii() and hmac.compare_digest(cached[0], token):
+        return cached[1]
+    return None
+
+
+def get_current_user(
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(security),
     session: Session = Depends(get_session)
 ) -> User:
@@ -153,6 +431,7 @@ async def get_current_user(
     如果任何一步失败，抛出401未授权错误
     
     参数：
+    - request: 当前请求，用于在请求内缓存已查询到的用户
     - credentials: HTTP认证凭证（包含token），由security自动提取
     - session: 数据库会话，用于查询用户
     
@@ -162,80 +441,76 @@ async def get_current_user(
     异常：
     - 如果token无效或用户不存在，抛出HTTPException(401)
     """
+    # 所有预期内的失败（token无效/过期、缺少用户ID、用户不存在）都直接抛出401，
+    # 不经过兜底的except，也不打印堆栈；数据库故障等意外异常交给FastAPI按500处理
+    
+    # 从credentials中提取token字符串
+    # credentials.credentials就是请求头中的token值
+    token = credentials.credentials
+    
+    # 同一请求内已经查询过该用户，直接复用，避免重复查询数据库
+    cached_user = _get_request_cached_user(request, token)
+    if cached_user is not None:
+        return cached_user
+    
+    # 验证token
+    payload = verify_token(token)
+    
+    # 如果token无效（过期、签名错误等）
+    if payload is None:
+        logger.debug("Token验证失败: token=%s...", token[:20])
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,  # 401未授权
+            detail="Invalid authentication credentials",  # 错误详情
+            headers={"WWW-Authenticate": "Bearer"},  # 告诉客户端使用Bearer认证
+        )
+    
+    # 从payload中获取用户ID
+    # "sub"是JWT标准字段，表示subject（主题/用户ID）
+    # 我们在create_access_token时设置的就是用户ID（字符串格式）
+    user_id_str = payload.get("sub")
+    
+    # 如果payload中没有用户ID
+    if user_id_str is None:
+        logger.debug("Token中缺少用户ID: payload=%s", payload)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid authentication credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    
+    # 将字符串转换为整数（数据库中的ID是整数类型）
     try:
-        # 从credentials中提取token字符串
-        # credentials.credentials就是请求头中的token值
-        token = credentials.credentials
-        
-        # 验证token
-        payload = verify_token(token)
-        
-        # 如果token无效（过期、签名错误等）
-        if payload is None:
-            print(f"Token验证失败: token={token[:20]}...")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,  # 401未授权
-                detail="Invalid authentication credentials",  # 错误详情
-                headers={"WWW-Authenticate": "Bearer"},  # 告诉客户端使用Bearer认证
-            )
-        
-        # 从payload中获取用户ID
-        # "sub"是JWT标准字段，表示subject（主题/用户ID）
-        # 我们在create_access_token时设置的就是用户ID（字符串格式）
-        user_id_str = payload.get("sub")
-        
-        # 如果payload中没有用户ID
-        if user_id_str is None:
-            print(f"Token中缺少用户ID: payload={payload}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        # 将字符串转换为整数（数据库中的ID是整数类型）
-        try:
-            user_id: int = int(user_id_str)
-        except (ValueError, TypeError):
-            print(f"无效的用户ID格式: {user_id_str}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Invalid authentication credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        # 从数据库中查询用户
-        # session.get(): 根据主键查询（User是模型类，user_id是主键值）
-        user = session.get(User, user_id)
-        
-        # 如果用户不存在（可能用户已被删除或数据库被重置）
-        if user is None:
-            print(f"用户不存在: user_id={user_id}")
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="User not found",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
-        
-        # 返回用户对象
-        return user
-    except HTTPException:
-        # 重新抛出HTTP异常
-        raise
-    except Exception as e:
-        # 其他异常记录日志并返回401
-        print(f"认证错误: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        user_id: int = int(user_id_str)
+    except (ValueError, TypeError):
+        logger.debug("无效的用户ID格式: %s", user_id_str)
+        # from None：不把ValueError挂到异常链上，401是预期内的失败，不需要额外的堆栈信息
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
+        ) from None
+    
+    # 从数据库中查询用户
+    user = _load_user(session, user_id)
+    
+    # 如果用户不存在（可能用户已被删除或数据库被重置）
+    if user is None:
+        logger.debug("用户不存在: user_id=%s", user_id)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="User not found",
+            headers={"WWW-Authenticate": "Bearer"},
         )
+    
+    # 缓存到本次请求中，并返回用户对象
+    setattr(request.state, _REQUEST_USER_ATTR, (token, user))
+    return user
 
 
-async def get_current_user_optional(
-    credentials: Optional[HTTPAuthorizationCredentials] = Depends(HTTPBearer(auto_error=False)),
+def get_current_user_optional(
+    request: Request,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(security_optional),
     session: Session = Depends(get_session)
 ) -> Optional[User]:
     """
@@ -254,6 +529,7 @@ async def get_current_user_optional(
         pass
     
     参数：
+    - request: 当前请求，用于在请求内缓存已查询到的用户
     - credentials: HTTP认证凭证（可选），如果未提供则返回None
     - session: 数据库会话
     
@@ -265,6 +541,10 @@ async def get_current_user_optional(
     
     try:
         token = credentials.credentials
+        cached_user = _get_request_cached_user(request, token)
+        if cached_user is not None:
+            return cached_user
+        
         payload = verify_token(token)
         
         if payload is None:
@@ -279,7 +559,9 @@ async def get_current_user_optional(
         except (ValueError, TypeError):
             return None
         
-        user = session.get(User, user_id)
+        user = _load_user(session, user_id)
+        if user is not None:
+            setattr(request.state, _REQUEST_USER_ATTR, (token, user))
         return user
     except Exception:
         # 任何错误都返回None（静默失败）
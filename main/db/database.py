@@ -9,6 +9,10 @@
 @date: 2025-11-20
 """
 from sqlmodel import SQLModel, create_engine, Session
+from sqlalchemy import event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql import functions
+from sqlalchemy.pool import NullPool
 import os
 
 # ==================== 环境判断 ====================
@@ -53,14 +57,31 @@ else:
     DATABASE_URL = "sqlite:///./test.db"
     print("✅ 使用 SQLite 数据库（本地开发环境）")
 
-# 创建数据库引擎
-# echo=True: 打印所有SQL语句（用于调试，生产环境可以设为False）
-# pool_pre_ping=True: 在每次使用连接前检查连接是否有效，如果无效则重新连接
-#   这对于无服务器环境（如 Vercel）很重要，因为连接可能会被关闭
-# pool_recycle=300: 连接回收时间（秒），300秒后重新创建连接
-#   防止长时间连接导致的 SSL 连接关闭问题
+# ==================== 连接池配置 ====================
+#
+# - Vercel（无服务器）+ PostgreSQL：每次调用都可能是新的实例，进程间无法复用连接池，
+#   使用 NullPool（用完即关），并建议 POSTGRES_URL 指向 PgBouncer 等外部连接池
+#   此时 pool_pre_ping 没有意义（连接都是新建的），反而每次取连接多一次往返，所以关闭
+# - 常驻进程 + PostgreSQL：使用 QueuePool，连接复用，避免每个请求都做一次 SSL 握手
+#   pool_size: 常驻连接数
+#   max_overflow: 高峰期允许额外创建的连接数
+#   pool_timeout: 连接池耗尽时等待的秒数，超时报错而不是无限等待
+#   pool_recycle: 连接回收时间（秒），防止长时间连接被服务端/代理关闭
+# - SQLite：使用 SQLAlchemy 默认连接池（内存数据库必须复用同一个连接，不能用 NullPool）
+#   本地文件数据库的连接不会被服务端断开，不需要 pool_pre_ping（每次取连接多执行一次 SELECT 1），
+#   也不需要定时回收（回收后新连接要重新执行 PRAGMA，SQLite 的页缓存也会丢失；内存数据库回收后数据直接丢失）
+#
+# 连接池参数都可以通过环境变量调整
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+
 # connect_args: 数据库连接参数
 connect_args = {}
+engine_kwargs = {}
+# 连接池最多能同时提供的连接数（pool_size + max_overflow）；不限制时为 None
+DB_POOL_CAPACITY = None
 if DATABASE_URL.startswith("postgresql://"):
     # PostgreSQL 连接参数
     # 确保 SSL 连接配置正确
@@ -68,15 +89,61 @@ if DATABASE_URL.startswith("postgresql://"):
         "sslmode": "require",
         "connect_timeout": "10",  # 连接超时时间（秒）
     }
+    if os.getenv("VERCEL"):
+        engine_kwargs = {"poolclass": NullPool}
+        print("✅ 无服务器环境：使用 NullPool（请配合 PgBouncer 等外部连接池）")
+    else:
+        engine_kwargs = {
+            "pool_size": DB_POOL_SIZE,
+            "max_overflow": DB_MAX_OVERFLOW,
+            "pool_timeout": DB_POOL_TIMEOUT,
+            "pool_recycle": DB_POOL_RECYCLE,
+            "pool_pre_ping": True,  # 使用前检查连接有效性
+        }
+        DB_POOL_CAPACITY = DB_POOL_SIZE + DB_MAX_OVERFLOW
 
+# 是否打印所有SQL语句（用于调试）
+# 每条SQL都会格式化并写日志，开销不小，默认关闭；需要时设置 SQL_ECHO=1
+SQL_ECHO = os.getenv("SQL_ECHO", "0") == "1"
+
+# 创建数据库引擎
 engine = create_engine(
     DATABASE_URL,
-    echo=True,
-    pool_pre_ping=True,  # 使用前检查连接有效性
-    pool_recycle=300,    # 300秒后回收连接
-    connect_args=connect_args
+    echo=SQL_ECHO,
+    connect_args=connect_args,
+    **engine_kwargs
 )
 
+# ==================== SQLite 连接参数 ====================
+# SQLite 默认使用回滚日志模式（rollback journal），每次写入都要对日志文件 fsync，
+# 并且写入时会阻塞读取。每个新连接建立时设置以下 PRAGMA：
+# - journal_mode=WAL: 预写日志模式，读写互不阻塞（该设置会持久化到数据库文件）
+# - synchronous=NORMAL: WAL 模式下只在检查点时 fsync，写入开销减半且不会损坏数据库
+# - temp_store=MEMORY: 临时表和排序用的临时数据放在内存中
+# - mmap_size=256MB: 通过内存映射读取数据库文件，少一次内存拷贝
+# - cache_size=-64000: 每个连接的页缓存约64MB（负数表示KB；默认只有约2MB），热数据常驻内存
+if DATABASE_URL.startswith("sqlite://"):
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.execute("PRAGMA mmap_size=268435456")
+        cursor.execute("PRAGMA cache_size=-64000")
+        cursor.close()
+
+
+# ==================== SQLite 时间戳精度 ====================
+# 模型中 created_at/updated_at 的列默认值（server_default）是 func.now()，在 SQLite 中默认生成 CURRENT_TIMESTAMP，
+# 只精确到秒（"2025-01-01 12:00:00"），而应用写入的时间戳带微秒（"2025-01-01 12:00:00.123456"）。
+# SQLite 中时间戳按字符串比较，两种格式混在一起时排序和 (时间, id) 游标分页比较都会出错，
+# 这里让 SQLite 中的 now() 生成与应用写入相同格式的时间（精确到毫秒，补齐6位小数），
+# 并且与应用一样使用本地时间（SQLite 的 'now' 是UTC，需要加 'localtime'）
+@compiles(functions.now, "sqlite")
+def sqlite_now(element, compiler, **kw):
+    return "STRFTIME('%Y-%m-%d %H:%M:%f000', 'now', 'localtime')"
+
 
 # ==================== 数据库会话管理 ====================
 
@@ -103,7 +170,12 @@ def get_session():
     4. 关闭Session，释放数据库连接
     """
     # 创建数据库会话
-    session = Session(engine)
+    # expire_on_commit=False: 提交后不让对象的属性全部过期，
+    # 接口在 commit 之后读取刚修改过的字段时不会再发一次 SELECT 重新加载
+    # （INSERT 之后需要按数据库中保存的值重新加载整行时，仍然调用 session.refresh）
+    # autoflush=False: 执行查询前不自动 flush 未提交的修改（接口都是修改后直接 commit，
+    # commit 时仍会 flush），认证时加入会话的缓存用户对象也不会在每次查询前被检查一遍
+    session = Session(engine, autoflush=False, expire_on_commit=False)
     try:
         # yield返回会话，函数暂停
         # FastAPI会使用这个会话执行API函数
@@ -123,6 +195,7 @@ def init_db():
     功能说明：
     1. 导入所有模型类（确保它们被注册到SQLModel.metadata中）
     2. 创建所有数据库表（如果表不存在）
+    3. 补建已存在的表上缺失的索引
     
     调用时机：
     在应用启动时调用（main.py中）
@@ -137,10 +210,28 @@ def init_db():
     # 如果不导入，SQLModel不知道要创建哪些表
     from db.models import User, Note, Like, Favorite, Comment, MemoryMoment, MemoryMomentLike
     
-    # 创建所有表
-    # SQLModel.metadata.create_all(engine) 会：
-    # 1. 检查metadata中注册的所有模型
-    # 2. 如果表不存在，创建表
-    # 3. 如果表已存在，不会修改（保持现有数据和结构）
-    SQLModel.metadata.create_all(engine)
-    print("数据库表初始化完成（已存在的表不会被修改）")
+    # 建表和补建索引都在同一个连接（同一个事务）中完成：
+    # 传入 engine 时每一步都会单独取一次连接，在 Vercel 上（NullPool）每次都是新建连接和 SSL 握手，
+    # 冷启动时要建立二十多个连接；共用一个连接后只需要建立一次
+    with engine.begin() as connection:
+        # 创建所有表
+        # SQLModel.metadata.create_all 会：
+        # 1. 检查metadata中注册的所有模型
+        # 2. 如果表不存在，创建表
+        # 3. 如果表已存在，不会修改（保持现有数据和结构）
+        SQLModel.metadata.create_all(connection)
+        
+        # create_all 只在建表时创建索引，已存在的表不会补建新增的索引
+        # 这里逐个检查并补建缺失的索引（checkfirst=True：已存在的索引会跳过）
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+    
+    # 关闭建表时放入连接池的连接：
+    # 使用 gunicorn --preload 时 init_db 只在主进程执行一次，之后 fork 出多个 worker，
+    # 如果连接池里留有连接，worker 会继承同一个数据库 socket 并互相干扰；
+    # 清空后每个 worker 在第一次查询时各自建立新连接
+    # （内存数据库除外：关闭连接会丢失其中的表）
+    if DATABASE_URL != "sqlite:///:memory:":
+        engine.dispose()
+    print("数据库表初始化完成（已存在的表不会被修改，缺失的索引会自动补建）")
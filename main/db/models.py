@@ -14,7 +14,27 @@ from sqlmodel import SQLModel, Field
 from typing import Optional, Dict, Any
 from datetime import datetime
 import json
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint, desc, func, text
+
+
+# ==================== 时间字段默认值 ====================
+# 创建/更新时间统一使用应用所在服务器的本地时间（datetime.now），与已有数据保持同一种约定
+# - default: 列级别的Python默认值，SQLAlchemy在INSERT时生成并写入（ORM和 insert() 语句都会使用），
+#   不依赖表结构中的列默认值，已存在的表（create_all 不会修改）同样有效；写入后对象上直接有这个值，不需要 refresh
+# - onupdate: ORM更新和 update() 语句没有指定该列时，自动写入当前时间
+# - server_default: 表结构中的列默认值，只对新建的表生效，兜底不经过应用的写入
+CREATED_AT_COLUMN = {"default": datetime.now, "server_default": func.now()}
+UPDATED_AT_COLUMN = {"default": datetime.now, "server_default": func.now(), "onupdate": datetime.now}
+
+
+# ==================== 部分索引条件 ====================
+# 只包含公开笔记的部分索引（partial index）条件，PostgreSQL 和 SQLite 都支持
+# 公开笔记通常只占笔记表的一小部分（私密笔记、草稿不会进入索引），索引更小、更容易常驻内存，
+# 写入私密笔记/草稿（如自动保存）时也不需要维护这些索引
+PUBLIC_NOTE_INDEX_WHERE = {
+    "postgresql_where": text("status = 'public'"),
+    "sqlite_where": text("status = 'public'"),
+}
 
 
 class User(SQLModel, table=True):
@@ -24,7 +44,7 @@ class User(SQLModel, table=True):
     字段说明：
     - id: 用户ID，主键，自动递增
     - username: 用户名，唯一索引（不能重复）
-    - password: 密码（注意：实际项目中应该加密存储）
+    - password: 密码的argon2id哈希（不保存明文）
     - email: 邮箱（可选）
     - avatar: 头像URL（可选）
     - nickname: 昵称（可选）
@@ -37,7 +57,7 @@ class User(SQLModel, table=True):
     """
     id: Optional[int] = Field(default=None, primary_key=True)  # 主键，自动递增
     username: str = Field(index=True, unique=True)  # 用户名，建立索引且唯一
-    password: str  # 密码字段
+    password: str  # 密码哈希（argon2id）
     email: Optional[str] = None  # 邮箱，可选字段
     avatar: Optional[str] = None  # 头像URL
     nickname: Optional[str] = None  # 昵称
@@ -45,10 +65,10 @@ class User(SQLModel, table=True):
     bio: Optional[str] = None  # 个人简介
     location: Optional[str] = None  # 所在地
     website: Optional[str] = None  # 个人网站
-    # 创建时间，使用default_factory在创建对象时自动设置当前时间
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
-    # 更新时间，使用default_factory在创建对象时自动设置当前时间
-    updated_at: Optional[datetime] = Field(default_factory=datetime.now)
+    # 创建时间，插入时自动设置为当前时间
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
+    # 更新时间，插入时自动设置为当前时间，更新该行时自动刷新为当前时间
+    updated_at: Optional[datetime] = Field(default=None, sa_column_kwargs=UPDATED_AT_COLUMN)
 
 
 class Note(SQLModel, table=True):
@@ -69,15 +89,30 @@ class Note(SQLModel, table=True):
     - private: 私密笔记（默认）
     - public: 公开笔记（已发布，会出现在"发现广场"）
     - draft: 草稿（私密的子状态，仅用于用户自我管理）
+    
+    索引：
+    - (published_at DESC, id DESC) WHERE status='public' 部分索引，支持"发现广场"按发布时间倒序读取公开笔记
+    - (user_id, updated_at) 复合索引，支持"我的笔记"按用户过滤并按最后编辑时间倒序
+    - (user_id, status, updated_at) 复合索引，支持"我的笔记"按状态筛选（私密/公开/草稿）时直接按索引顺序读取，
+      不需要逐行检查状态
+    - (user_id, published_at DESC, id DESC) WHERE status='public' 部分索引，支持"用户公开文章"按用户过滤并按发布时间倒序
+      （列表直接按索引顺序读取不需要排序，总数统计只需扫描索引）
     """
+    __table_args__ = (
+        Index("ix_note_public_pub", desc("published_at"), desc("id"), **PUBLIC_NOTE_INDEX_WHERE),
+        Index("ix_note_user_updated", "user_id", "updated_at"),
+        Index("ix_note_user_status_updated", "user_id", "status", "updated_at"),
+        Index("ix_note_public_user_pub", "user_id", desc("published_at"), desc("id"), **PUBLIC_NOTE_INDEX_WHERE),
+    )
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)  # 外键，关联到user表
     title: str = Field(index=True)  # 标题，建立索引支持搜索
     content: str  # 内容，Markdown格式存储
     status: str = Field(default="private")  # 状态：private/public/draft
     published_at: Optional[datetime] = None  # 发布时间（公开时设置）
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
-    updated_at: Optional[datetime] = Field(default_factory=datetime.now)
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
+    updated_at: Optional[datetime] = Field(default=None, sa_column_kwargs=UPDATED_AT_COLUMN)
 
 
 class Like(SQLModel, table=True):
@@ -92,13 +127,17 @@ class Like(SQLModel, table=True):
     
     索引：
     - (user_id, note_id) 唯一索引，防止重复点赞
+    - (note_id, user_id) 复合索引，支持按笔记统计点赞数和"我是否点赞"查询
     """
-    __table_args__ = (UniqueConstraint("user_id", "note_id", name="unique_user_note_like"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "note_id", name="unique_user_note_like"),
+        Index("ix_like_note_user", "note_id", "user_id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     note_id: int = Field(foreign_key="note.id", index=True)
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
 
 
 class Favorite(SQLModel, table=True):
@@ -113,13 +152,17 @@ class Favorite(SQLModel, table=True):
     
     索引：
     - (user_id, note_id) 唯一索引，防止重复收藏
+    - (note_id, user_id) 复合索引，支持按笔记统计收藏数和"我是否收藏"查询
     """
-    __table_args__ = (UniqueConstraint("user_id", "note_id", name="unique_user_note_favorite"),)
+    __table_args__ = (
+        UniqueConstraint("user_id", "note_id", name="unique_user_note_favorite"),
+        Index("ix_favorite_note_user", "note_id", "user_id"),
+    )
     
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     note_id: int = Field(foreign_key="note.id", index=True)
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
 
 
 class Comment(SQLModel, table=True):
@@ -137,13 +180,16 @@ class Comment(SQLModel, table=True):
     索引：
     - note_id: 索引，用于快速查询某笔记的所有评论
     - parent_id: 索引，用于快速查询某评论的所有回复
+    - (note_id, created_at) 复合索引，按时间顺序读取某笔记的评论时无需额外排序
     """
+    __table_args__ = (Index("ix_comment_note_created", "note_id", "created_at"),)
+    
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     note_id: int = Field(foreign_key="note.id", index=True)
     parent_id: Optional[int] = Field(default=None, foreign_key="comment.id", index=True)  # 父评论ID，用于嵌套回复
     content: str  # 评论内容
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
 
 
 class MemoryMoment(SQLModel, table=True):
@@ -165,7 +211,7 @@ class MemoryMoment(SQLModel, table=True):
     user_id: int = Field(foreign_key="user.id", index=True)
     image_url: str  # 图片URL
     description: Optional[str] = Field(default=None, max_length=50)  # 描述，最多50字
-    created_at: Optional[datetime] = Field(default_factory=datetime.now, index=True)
+    created_at: Optional[datetime] = Field(default=None, index=True, sa_column_kwargs=CREATED_AT_COLUMN)
 
 
 class MemoryMomentLike(SQLModel, table=True):
@@ -186,4 +232,4 @@ class MemoryMomentLike(SQLModel, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     user_id: int = Field(foreign_key="user.id", index=True)
     memory_id: int = Field(foreign_key="memorymoment.id", index=True)
-    created_at: Optional[datetime] = Field(default_factory=datetime.now)
+    created_at: Optional[datetime] = Field(default=None, sa_column_kwargs=CREATED_AT_COLUMN)
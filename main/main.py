@@ -11,21 +11,41 @@ FastAPI 主应用文件
 @author: lixiang
 @date: 2025-11-20
 """
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import FastAPI, Depends, HTTPException, Request, status, UploadFile, File
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from sqlmodel import Session, select
-from typing import List, Optional
+from sqlalchemy import delete, func, insert, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from pydantic import BaseModel, Field
-from db.database import init_db, get_session
+from db.database import init_db, get_session, engine, DB_POOL_CAPACITY
 from db.models import User, Note, Like, Favorite, Comment, MemoryMoment, MemoryMomentLike
-from auth import create_access_token, get_current_user, get_current_user_optional
+from auth import (
+    create_access_token,
+    get_current_user,
+    get_current_user_optional,
+    hash_password,
+    invalidate_user_cache,
+    load_user_profile,
+    password_needs_rehash,
+    verify_password,
+)
 import uvicorn
+import anyio
+import hashlib
+import logging
 import os
 import shutil
+import sys
+import threading
+import time
 import re
-import json
+import secrets
+import orjson
 from pathlib import Path
 from urllib import error, request
 import cloudinary
@@ -36,7 +56,11 @@ import cloudinary.uploader
 # 创建FastAPI应用实例
 # title: API文档中显示的标题
 # version: API版本号
-app = FastAPI(title="家书后端API", version="1.0.0")
+# default_response_class=ORJSONResponse: 返回的dict直接用orjson序列化（比标准库json快得多）
+# 接口返回的字典中时间字段直接放 datetime 对象，由 orjson 在C代码中转换为ISO 8601字符串（格式与 isoformat() 相同）
+# 注意：接口直接 return dict 时，FastAPI 会先用 jsonable_encoder（纯Python递归）把整个字典转换一遍再交给 ORJSONResponse，
+# 所以接口统一返回 ORJSONResponse(content=...)，跳过这一步，由 orjson 直接序列化
+app = FastAPI(title="家书后端API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # ==================== CORS跨域配置 ====================
 # 配置CORS（跨域资源共享），允许前端访问后端API
@@ -50,8 +74,6 @@ app = FastAPI(title="家书后端API", version="1.0.0")
 # - 浏览器的同源策略会阻止跨域请求
 # - 前端和后端可能部署在不同的域名/端口上
 # - CORS 允许后端明确指定哪些前端可以访问API
-import os
-import re
 
 # ==================== 环境判断 ====================
 # Vercel 会自动设置 VERCEL_ENV 环境变量：
@@ -61,6 +83,20 @@ import re
 vercel_env = os.getenv("VERCEL_ENV", "development")
 print(f"🌍 当前环境: {vercel_env}")
 
+# 是否运行在 Vercel 上（Vercel 会设置 VERCEL 环境变量），进程启动后不会变化，只判断一次
+IS_VERCEL = bool(os.getenv("VERCEL"))
+
+# ==================== 日志配置 ====================
+# 正式环境只输出 WARNING 及以上级别，其他环境输出 INFO
+# 可以通过 LOG_LEVEL 环境变量覆盖（例如 LOG_LEVEL=DEBUG 查看 token 验证细节）
+log_level = os.getenv("LOG_LEVEL") or ("WARNING" if vercel_env == "production" else "INFO")
+logging.basicConfig(level=log_level.upper())
+
+logger = logging.getLogger(__name__)
+# CORS 中间件的逐请求日志单独使用一个 logger，默认级别下不输出；
+# 排查跨域问题时设置 LOG_LEVEL=DEBUG 即可看到每个请求的来源匹配过程
+cors_logger = logging.getLogger("cors")
+
 # 从环境变量读取允许的来源
 allowed_origins_env = os.getenv("ALLOWED_ORIGINS", "")
 if allowed_origins_env:
@@ -82,96 +118,170 @@ else:
         allowed_origins = ["http://localhost:3000"]
         print(f"✅ 开发环境：默认允许 localhost:3000")
 
+# 允许的来源在启动后不会变化，这里预先整理好，每个请求只做查找和匹配：
+# - 精确来源放入 frozenset，O(1) 判断
+# - 通配符来源（如 https://*.vercel.app）预先编译为正则，不在每个请求中重新拼接和编译
+ALLOWED_ORIGINS_EXACT = frozenset(origin for origin in allowed_origins if "*" not in origin)
+ALLOWED_ORIGIN_PATTERNS = [
+    (origin, re.compile(origin.replace(".", r"\.").replace("*", r".*")))
+    for origin in allowed_origins if "*" in origin
+]
+
+# 所有 Vercel 域名（包括预览和正式环境）自动允许
+VERCEL_ORIGIN_SUFFIX = ".vercel.app"
+
+# 预检请求结果的缓存时间（秒），默认24小时
+# 浏览器在这段时间内对同一接口的跨域请求不再重复发送 OPTIONS 预检，每次调用少一次往返
+# （各浏览器有自己的上限，例如 Chrome 最多缓存2小时，超出部分会被截断）
+CORS_MAX_AGE = os.getenv("CORS_MAX_AGE", "86400")
+
 # 自定义 CORS 中间件，支持通配符匹配
-@app.middleware("http")
-async def add_cors_headers(request, call_next):
-    origin = request.headers.get("origin")
-    method = request.method
-    path = request.url.path
-    
-    # 记录所有请求（包括 OPTIONS）
-    print(f"🌐 收到请求: {method} {path}, Origin: {origin}, 环境: {vercel_env}")
-    
-    # 检查是否允许该来源
-    is_allowed = False
-    if origin:
-        # 检查是否在允许列表中
-        for allowed_origin in allowed_origins:
-            if allowed_origin == origin:
-                is_allowed = True
-                print(f"✅ 来源匹配允许列表: {origin}")
+# 
+# 使用纯 ASGI 中间件类，而不是 @app.middleware("http")：
+# @app.middleware("http") 基于 Starlette 的 BaseHTTPMiddleware，每个请求都会额外创建一个任务，
+# 并把整个响应体经过内存通道在两个任务之间转发一遍；
+# 纯 ASGI 中间件直接从 scope 读取请求头，只在响应开始（http.response.start）时往响应头列表中追加 CORS 头，
+# 不构建 Request 对象，也不经手响应体
+class CORSHeadersMiddleware:
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        # 只处理 HTTP 请求（websocket、lifespan 直接交给下一层）
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        # 请求头是 (bytes, bytes) 元组的列表，名称已经是小写
+        origin = None
+        for key, value in scope["headers"]:
+            if key == b"origin":
+                origin = value.decode("latin-1")
                 break
-            # 支持通配符匹配：*.vercel.app
-            elif "*" in allowed_origin:
-                pattern = allowed_origin.replace(".", r"\.").replace("*", r".*")
-                if re.match(pattern, origin):
-                    is_allowed = True
-                    print(f"✅ 来源匹配通配符: {allowed_origin} -> {origin}")
-                    break
+        method = scope["method"]
         
-        # 自动允许所有 Vercel 域名（包括预览和正式环境）
-        if not is_allowed and origin.endswith(".vercel.app"):
-            is_allowed = True
-            print(f"✅ 自动允许 Vercel 域名: {origin} (环境: {vercel_env})")
-    
-    # 处理 OPTIONS 预检请求
-    if request.method == "OPTIONS":
-        from fastapi.responses import Response
-        # 对于 OPTIONS 请求，如果来源是 Vercel 域名，总是允许
-        if origin and origin.endswith(".vercel.app"):
-            is_allowed = True
-            print(f"✅ [OPTIONS] 自动允许 Vercel 域名: {origin}")
+        # 逐请求日志只在 DEBUG 级别输出，每个请求只判断一次，关闭时不格式化日志字符串
+        debug = cors_logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            cors_logger.debug("收到请求: %s %s, Origin: %s, 环境: %s", method, scope["path"], origin, vercel_env)
         
-        # 返回 CORS 预检响应（必须返回具体的 origin，不能是 "*"）
-        cors_origin = origin if origin else "*"
-        print(f"📤 [OPTIONS] 返回 CORS 响应: Origin={cors_origin}, Path={path}")
-        return Response(
-            status_code=200,
-            headers={
-                "Access-Control-Allow-Origin": cors_origin,
-                "Access-Control-Allow-Credentials": "true",
-                "Access-Control-Allow-Methods": "*",
-                "Access-Control-Allow-Headers": "*",
-            }
-        )
-    
-    # 处理实际请求
-    print(f"➡️  处理实际请求: {method} {path}, Origin: {origin}, Allowed: {is_allowed}")
-    response = await call_next(request)
-    
-    # 如果允许该来源，添加 CORS 头
-    if origin:
-        # 再次检查（确保 Vercel 域名被允许）
-        if not is_allowed and origin.endswith(".vercel.app"):
-            is_allowed = True
-            print(f"✅ 实际请求时自动允许 Vercel 域名: {origin}")
+        # 检查是否允许该来源
+        is_allowed = False
+        if origin:
+            # 检查是否在允许列表中
+            if origin in ALLOWED_ORIGINS_EXACT:
+                is_allowed = True
+            else:
+                # 支持通配符匹配：*.vercel.app
+                for allowed_origin, pattern in ALLOWED_ORIGIN_PATTERNS:
+                    if pattern.match(origin):
+                        is_allowed = True
+                        if debug:
+                            cors_logger.debug("来源匹配通配符: %s -> %s", allowed_origin, origin)
+                        break
+            
+            # 自动允许所有 Vercel 域名（包括预览和正式环境）
+            if not is_allowed and origin.endswith(VERCEL_ORIGIN_SUFFIX):
+                is_allowed = True
         
-        if is_allowed:
-            response.headers["Access-Control-Allow-Origin"] = origin
-            response.headers["Access-Control-Allow-Credentials"] = "true"
-            response.headers["Access-Control-Allow-Methods"] = "*"
-            response.headers["Access-Control-Allow-Headers"] = "*"
-            print(f"✅ 已添加 CORS 头: Origin={origin}")
-        else:
-            print(f"⚠️  来源未允许，未添加 CORS 头: {origin}")
-    
-    return response
-
-# 使用 FastAPI 的 CORS 中间件
-# 注意：自定义中间件已经处理了 CORS，这里作为备用
-# 如果 allowed_origins 为空，FastAPI 中间件可能不会正确处理，所以主要依赖自定义中间件
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=allowed_origins if allowed_origins else ["*"],  # 如果为空，允许所有来源（由自定义中间件控制）
-    allow_credentials=True,  # 允许携带认证信息（如cookie、token）
-    allow_methods=["*"],  # 允许所有HTTP方法（GET、POST、PUT、DELETE等）
-    allow_headers=["*"],  # 允许所有请求头
-)
+        # 处理 OPTIONS 预检请求
+        if method == "OPTIONS":
+            # 来源不在允许范围内的预检请求直接拒绝（与原先外层 Starlette CORSMiddleware 的行为一致），
+            # 浏览器不会再发出实际请求
+            if origin and not is_allowed:
+                if debug:
+                    cors_logger.debug("拒绝预检请求: Origin: %s", origin)
+                response = Response("Disallowed CORS origin", status_code=400, media_type="text/plain", headers={"Vary": "Origin"})
+                await response(scope, receive, send)
+                return
+            
+            # 返回 CORS 预检响应（必须返回具体的 origin，不能是 "*"）
+            cors_origin = origin if origin else "*"
+            response = Response(
+                status_code=200,
+                headers={
+                    "Access-Control-Allow-Origin": cors_origin,
+                    "Access-Control-Allow-Credentials": "true",
+                    "Access-Control-Allow-Methods": "*",
+                    "Access-Control-Allow-Headers": "*",
+                    "Access-Control-Max-Age": CORS_MAX_AGE,
+                    # 响应内容随 Origin 变化，CDN/代理缓存需要按 Origin 区分
+                    "Vary": "Origin",
+                }
+            )
+            await response(scope, receive, send)
+            return
+        
+        # 处理实际请求
+        if debug:
+            cors_logger.debug("Origin: %s, Allowed: %s", origin, is_allowed)
+        if not origin or not is_allowed:
+            await self.app(scope, receive, send)
+            return
+        
+        # 如果允许该来源，在响应开始时添加 CORS 头
+        cors_headers = [
+            (b"access-control-allow-origin", origin.encode("latin-1")),
+            (b"access-control-allow-credentials", b"true"),
+            (b"access-control-allow-methods", b"*"),
+            (b"access-control-allow-headers", b"*"),
+            (b"vary", b"Origin"),
+        ]
+        
+        async def send_with_cors_headers(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *cors_headers]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_cors_headers)
+
+
+# ==================== 响应压缩 ====================
+# 客户端支持 gzip（Accept-Encoding）且响应体不小于 GZIP_MINIMUM_SIZE 字节时压缩响应，
+# 笔记列表等 JSON 文本通常能压缩到原来的 20%~30%，移动网络下传输更快
+# 太小的响应压缩后省不了多少字节，反而要额外消耗 CPU，所以不压缩
+# 压缩中间件注册在 CORS 中间件之前（位于其内层），CORS 头添加在压缩后的响应上
+GZIP_MINIMUM_SIZE = 1000
+GZIP_COMPRESS_LEVEL = 5  # 压缩级别（1~9），5 在压缩率和速度之间比较均衡
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MINIMUM_SIZE, compresslevel=GZIP_COMPRESS_LEVEL)
+
+# CORS 只由自定义中间件处理（不再叠加 FastAPI/Starlette 的 CORSMiddleware），每个请求只经过一层 CORS 处理
+app.add_middleware(CORSHeadersMiddleware)
 
 # 初始化数据库
 # 在应用启动时创建数据库表结构
 init_db()
 
+# ==================== 线程池配置 ====================
+# 同步接口（def）由 FastAPI 放到线程池中执行，不会阻塞事件循环；
+# 线程池默认最多 40 个线程，同时也就是同步接口的最大并发数
+# 
+# 每个同步接口都要占用一个数据库连接：
+# - 线程数多于连接数时，多出的线程只能排队等连接，等待超过 pool_timeout 就会报错
+# - 线程数少于连接数时，连接池用不满
+# 所以默认让线程数与连接池容量（pool_size + max_overflow）一致，
+# 也可以通过 THREADPOOL_SIZE 环境变量单独指定
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "0")) or DB_POOL_CAPACITY
+
+
+@app.on_event("startup")
+async def configure_threadpool():
+    """启动时调整同步接口使用的线程池大小（必须在事件循环中调用）"""
+    if THREADPOOL_SIZE:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+        print(f"✅ 线程池大小: {THREADPOOL_SIZE}")
+
+
+@app.on_event("shutdown")
+def close_db_connections():
+    """
+    退出时关闭连接池中的数据库连接
+    
+    连接池（QueuePool）中的连接是常驻的，worker 退出（重启、扩缩容）时主动关闭，
+    数据库端能立即释放这些连接，而不是等 TCP 超时后才回收；NullPool 下没有常驻连接，调用也没有开销
+    """
+    engine.dispose()
+
 # ==================== Cloudinary 云存储配置 ====================
 # Cloudinary 是一个云存储服务，用于在 Vercel 等无服务器环境中存储文件
 # 
@@ -194,8 +304,11 @@ cloudinary_cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
 cloudinary_api_key = os.getenv("CLOUDINARY_API_KEY")
 cloudinary_api_secret = os.getenv("CLOUDINARY_API_SECRET")
 
+# 是否使用 Cloudinary（三个环境变量都配置了才使用），启动时确定，上传接口中直接使用
+USE_CLOUDINARY = bool(cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret)
+
 # 如果配置了 Cloudinary，则初始化
-if cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret:
+if USE_CLOUDINARY:
     cloudinary.config(
         cloud_name=cloudinary_cloud_name,
         api_key=cloudinary_api_key,
@@ -211,7 +324,7 @@ else:
 # - Vercel 是无服务器环境，文件系统是只读的，无法创建目录和写入文件
 # - 在 Vercel 环境下跳过静态文件目录的创建和挂载
 # - 文件上传功能需要使用云存储（如 AWS S3、Cloudinary 等）
-if not os.getenv("VERCEL"):
+if not IS_VERCEL:
     # 本地开发环境：创建uploads目录并挂载静态文件服务
     os.makedirs("uploads/avatars", exist_ok=True)
     os.makedirs("uploads/notes", exist_ok=True)
@@ -223,6 +336,62 @@ else:
     print("⚠️  检测到 Vercel 环境，跳过静态文件目录创建")
     print("⚠️  文件上传功能需要使用云存储（如 AWS S3、Cloudinary 等）")
 
+# 上传图片大小限制（5MB）
+UPLOAD_MAX_SIZE = 5 * 1024 * 1024
+
+# 允许上传的图片格式的文件头（magic bytes）：PNG、JPEG、GIF
+IMAGE_MAGIC_PREFIXES = (
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"\xff\xd8\xff",  # JPEG
+    b"GIF87a",  # GIF
+    b"GIF89a",  # GIF
+)
+
+
+def get_upload_size(file: UploadFile) -> int:
+    """
+    获取上传文件的大小（字节），不把文件内容读入内存
+    
+    上传的文件已经由框架暂存在临时文件中（较大的文件在磁盘上），
+    这里只移动文件指针计算大小，然后把指针移回开头，后续可以直接把 file.file 交给上传/保存逻辑
+    """
+    file.file.seek(0, os.SEEK_END)
+    size = file.file.tell()
+    file.file.seek(0)
+    return size
+
+
+def is_image_upload(file: UploadFile) -> bool:
+    """
+    根据文件头（前12字节）判断上传文件是否是允许的图片格式（PNG/JPEG/GIF）
+    
+    Content-Type 由客户端随意填写，不能作为依据；这里只读取文件开头几个字节，
+    然后把指针移回开头，后续仍可以直接把 file.file 交给上传/保存逻辑
+    """
+    header = file.file.read(12)
+    file.file.seek(0)
+    return header.startswith(IMAGE_MAGIC_PREFIXES)
+
+
+def make_upload_suffix() -> str:
+    """
+    生成上传文件名中的唯一后缀：秒级时间戳 + 8位随机十六进制
+    
+    只用时间戳时，同一用户在同一秒内上传两张图片会生成相同的文件名（本地文件被覆盖、云存储 public_id 冲突），
+    加上随机部分后不会重复
+    """
+    return f"{time.time_ns() // 1_000_000_000}_{secrets.token_hex(4)}"
+
+
+def save_upload_file(file: UploadFile, file_path: Path) -> None:
+    """
+    把上传文件保存到本地路径（分块复制，不一次性读入整个文件）
+    
+    这是同步的磁盘IO，在async接口中需要通过run_in_threadpool调用
+    """
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
 
 # ==================== 请求/响应数据模型定义 ====================
 # 这些类定义了API接口的请求和响应数据结构
@@ -318,10 +487,147 @@ def build_editor_system_prompt() -> str:
     )
 
 
+# HTML标签 / 连续空白的正则（模块加载时编译一次，避免每次调用都重新查找/编译）
+HTML_TAG_RE = re.compile(r"<[^>]+>")
+WHITESPACE_RE = re.compile(r"\s+")
+
+# 列表中内容预览的长度（字符）
+CONTENT_PREVIEW_LENGTH = 50
+
+# 生成预览时从正文开头截取的原文长度（字符）
+# HTML标签本身会占用字符，先截取一段更长的原文去掉标签后再截取预览长度，
+# 避免预览被标签占满而过短，或末尾残留被截断的半个标签（如 "<span cla"）
+CONTENT_PREVIEW_SOURCE_LENGTH = 200
+
+
+def make_content_preview(content: Optional[str]) -> str:
+    """
+    生成列表中的内容预览（前50字符，去除HTML标签）
+    
+    只截取开头部分再去标签，不会对整篇正文跑正则；
+    纯文本（不含 '<'）直接截取，不经过正则
+    """
+    if not content:
+        return ""
+    if "<" not in content[:CONTENT_PREVIEW_SOURCE_LENGTH]:
+        return content[:CONTENT_PREVIEW_LENGTH]
+    return HTML_TAG_RE.sub("", content[:CONTENT_PREVIEW_SOURCE_LENGTH])[:CONTENT_PREVIEW_LENGTH]
+
+
+# 列表中作者不存在（已被删除）时返回的作者信息，保持字段齐全
+EMPTY_AUTHOR_INFO = {"id": "", "nickname": "", "avatar": None}
+
+# 查询笔记时一并带出的作者展示字段（配合 LEFT JOIN User 使用）
+# 只取构建作者信息需要的列，不加载整行 User（密码哈希、邮箱、手机号等不会被查询出来）
+AUTHOR_COLUMNS = (
+    User.id.label("author_id"),
+    User.username.label("author_username"),
+    User.nickname.label("author_nickname"),
+    User.avatar.label("author_avatar"),
+)
+
+
+def build_author_info(author: Optional[User]) -> Optional[dict]:
+    """构建作者展示信息（ID、昵称（没有昵称时用用户名）、头像），作者不存在时返回None"""
+    if author is None:
+        return None
+    return {
+        "id": str(author.id),
+        "nickname": author.nickname or author.username,
+        "avatar": author.avatar,
+    }
+
+
+def build_author_info_from_row(row) -> Optional[dict]:
+    """从带有 AUTHOR_COLUMNS 的查询结果行构建作者展示信息，作者不存在（LEFT JOIN 为空）时返回None"""
+    if row.author_id is None:
+        return None
+    return {
+        "id": str(row.author_id),
+        "nickname": row.author_nickname or row.author_username,
+        "avatar": row.author_avatar,
+    }
+
+
+def get_own_note(session: Session, note_id: int, user_id: int) -> Note:
+    """
+    查询属于指定用户的笔记，不存在或不属于该用户时抛出404
+    
+    归属条件直接放在 WHERE 中（走主键），不属于当前用户的笔记不会被读取出来
+    """
+    note = session.exec(select(Note).where(Note.id == note_id).where(Note.user_id == user_id)).first()
+    if not note:
+        raise HTTPException(status_code=404, detail="笔记不存在")
+    return note
+
+
+def note_exists(session: Session, note_id: int) -> bool:
+    """笔记是否存在（只查询主键，不加载笔记正文）"""
+    return session.exec(select(Note.id).where(Note.id == note_id)).first() is not None
+
+
+def find_note_owner(session: Session, note_id: int):
+    """
+    查询笔记的作者ID和状态（user_id, status），笔记不存在时返回None
+    
+    喜爱/收藏/评论变化后用来判断是否需要清除公开内容缓存，只查询这两列，不加载笔记正文
+    """
+    return session.exec(select(Note.user_id, Note.status).where(Note.id == note_id)).first()
+
+
+def find_user_note_record_id(session: Session, model, user_id: int, note_id: int) -> Optional[int]:
+    """
+    查询用户对笔记的喜爱/收藏记录ID，不存在时返回None
+    
+    只查询主键（走 (user_id, note_id) 唯一索引），不构建ORM对象
+    """
+    return session.exec(
+        select(model.id).where(model.user_id == user_id).where(model.note_id == note_id).limit(1)
+    ).first()
+
+
+def toggle_user_note_record(session: Session, model, user_id: int, note_id: int) -> bool:
+    """
+    切换用户对笔记的喜爱/收藏状态并提交，返回切换后是否处于喜爱/收藏状态
+    
+    直接执行 DELETE：删除了记录说明原来已喜爱/收藏（切换为取消）；
+    没有删除任何记录时再 INSERT 一条。不需要先查询是否存在，也不构建ORM对象
+    """
+    deleted = session.exec(delete(model).where(model.user_id == user_id).where(model.note_id == note_id))
+    if deleted.rowcount:
+        session.commit()
+        return False
+    try:
+        session.exec(insert(model).values(user_id=user_id, note_id=note_id))
+        session.commit()
+    except IntegrityError:
+        # 同一用户的并发请求（如连续点击）已经插入了这条记录，结果同样是已喜爱/收藏
+        session.rollback()
+    return True
+
+
+def count_note_records(session: Session, model, note_id: int) -> int:
+    """统计一篇笔记的喜爱/收藏数（SELECT COUNT(*)，走 (note_id, user_id) 索引）"""
+    return session.exec(select(func.count()).select_from(model).where(model.note_id == note_id)).one()
+
+
+def count_by_note(session: Session, model, note_ids: List[int]) -> Dict[int, int]:
+    """
+    批量统计多篇笔记的记录数（喜爱/收藏/评论），返回 {笔记ID: 数量}，没有记录的笔记不在结果中
+    
+    一条 GROUP BY 查询统计整页笔记，不需要每篇笔记单独查询，也不把每条记录都加载成对象
+    """
+    if not note_ids:
+        return {}
+    return dict(session.exec(
+        select(model.note_id, func.count()).where(model.note_id.in_(note_ids)).group_by(model.note_id)
+    ).all())
+
+
 def strip_html_preview(html: str) -> str:
     """生成适合放入 prompt 的正文预览，避免原始 HTML 过长。"""
-    text = re.sub(r"<[^>]+>", " ", html or "")
-    text = re.sub(r"\s+", " ", text).strip()
+    text = HTML_TAG_RE.sub(" ", html or "")
+    text = WHITESPACE_RE.sub(" ", text).strip()
     if len(text) > EDITOR_CONTENT_CHAR_LIMIT:
         return text[:EDITOR_CONTENT_CHAR_LIMIT] + "\n...[正文过长，已截断]"
     return text
@@ -355,14 +661,15 @@ def call_minimax_editor_chat(payload: AIEditorChatRequest) -> str:
     if not minimax_api_key:
         raise HTTPException(status_code=500, detail="未配置 MINIMAX_API_KEY")
 
-    body = json.dumps(
+    # orjson 直接输出 UTF-8 bytes，省去一次 str -> bytes 编码
+    body = orjson.dumps(
         {
             "model": MINIMAX_MODEL,
             "messages": build_editor_messages(payload),
             "temperature": 0.7,
             "top_p": 0.95,
         }
-    ).encode("utf-8")
+    )
 
     req = request.Request(
         MINIMAX_API_URL,
@@ -376,26 +683,26 @@ def call_minimax_editor_chat(payload: AIEditorChatRequest) -> str:
 
     try:
         with request.urlopen(req, timeout=MINIMAX_TIMEOUT_SECONDS) as resp:
-            response_data = json.loads(resp.read().decode("utf-8"))
+            response_data = orjson.loads(resp.read())
     except error.HTTPError as exc:
         error_body = exc.read().decode("utf-8", errors="ignore")
-        print(f"MiniMax HTTP错误: status={exc.code}, body={error_body}")
+        logger.error("MiniMax HTTP错误: status=%s, body=%s", exc.code, error_body)
         raise HTTPException(status_code=502, detail="MiniMax 服务调用失败")
     except error.URLError as exc:
-        print(f"MiniMax 网络错误: {str(exc)}")
+        logger.error("MiniMax 网络错误: %s", exc)
         raise HTTPException(status_code=502, detail="MiniMax 服务暂时不可用")
     except Exception as exc:
-        print(f"MiniMax 未知错误: {type(exc).__name__}: {str(exc)}")
+        logger.exception("MiniMax 未知错误: %s: %s", type(exc).__name__, exc)
         raise HTTPException(status_code=500, detail="AI 助手调用失败")
 
     if response_data.get("base_resp", {}).get("status_code") not in (None, 0):
-        print(f"MiniMax 业务错误: {response_data}")
+        logger.error("MiniMax 业务错误: %s", response_data)
         raise HTTPException(status_code=502, detail="MiniMax 返回异常")
 
     try:
         reply = response_data["choices"][0]["message"]["content"].strip()
     except (KeyError, IndexError, AttributeError, TypeError):
-        print(f"MiniMax 响应解析失败: {response_data}")
+        logger.error("MiniMax 响应解析失败: %s", response_data)
         raise HTTPException(status_code=502, detail="MiniMax 响应格式异常")
 
     if not reply:
@@ -406,14 +713,14 @@ def call_minimax_editor_chat(payload: AIEditorChatRequest) -> str:
 
 # ==================== 认证相关接口 ====================
 
-@app.post("/api/auth/register", response_model=dict)
+@app.post("/api/auth/register")
 def register(data: RegisterRequest, session: Session = Depends(get_session)):
     """
     用户注册接口
     
     功能说明：
-    1. 检查用户名是否已存在
-    2. 如果不存在，创建新用户
+    1. 创建新用户
+    2. 用户名已存在时返回400（由数据库唯一约束判断）
     3. 返回注册结果
     
     参数：
@@ -425,45 +732,37 @@ def register(data: RegisterRequest, session: Session = Depends(get_session)):
     - 失败：返回错误信息（用户名已存在或服务器错误）
     """
     try:
-        # 查询数据库中是否已存在该用户名
-        # select(User): 选择User表
-        # .where(): 添加查询条件
-        # .first(): 获取第一条结果，如果没有则返回None
-        user = session.exec(select(User).where(User.username == data.username)).first()
-        
-        # 如果用户已存在，返回400错误
-        if user:
-            raise HTTPException(status_code=400, detail="用户名已存在")
-        
         # 创建新用户对象
         # User是数据库模型类，对应数据库中的user表
         new_user = User(
             username=data.username,
-            password=data.password,  # 注意：实际项目中应该使用密码加密（如bcrypt）
+            password=hash_password(data.password),  # 只保存argon2哈希，不保存明文
             email=data.email
         )
         
         # 将新用户添加到数据库会话
         session.add(new_user)
         # 提交事务，将数据保存到数据库
-        session.commit()
-        # 刷新对象，获取数据库自动生成的ID等字段
-        session.refresh(new_user)
+        # 不预先查询用户名是否存在：username 有唯一约束，重复时插入会失败（IntegrityError），
+        # 正常注册只需要一条 INSERT；插入后 new_user.id 已由数据库填充，不需要再 refresh
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise HTTPException(status_code=400, detail="用户名已存在") from None
         
         # 返回成功响应
-        return {
+        return ORJSONResponse(content={
             "code": 200,
             "message": "注册成功",
             "data": {"user_id": new_user.id}
-        }
+        })
     except HTTPException:
         # HTTP异常直接重新抛出（如用户名已存在）
         raise
     except Exception as e:
         # 其他异常记录日志并返回500错误
-        print(f"注册错误: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()  # 打印完整的错误堆栈
+        logger.exception("注册错误: %s: %s", type(e).__name__, e)  # 同时记录完整的错误堆栈
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
@@ -486,21 +785,26 @@ def login(data: LoginRequest, session: Session = Depends(get_session)):
     - 失败：返回401错误（用户名或密码错误）
     """
     try:
-        print(f"🔐 登录请求：用户名 = {data.username}")
-        # 查询用户：用户名和密码都匹配
+        logger.debug("登录请求：用户名 = %s", data.username)
+        # 按用户名查询用户，再在应用层验证密码哈希
         user = session.exec(
-            select(User).where(
-                User.username == data.username,
-                User.password == data.password
-            )
+            select(User).where(User.username == data.username)
         ).first()
         
         # 如果用户不存在或密码错误
-        if not user:
-            print(f"❌ 登录失败：用户名或密码错误（用户名 = {data.username}）")
+        # 用户不存在时verify_password也会做一次哈希比对，两种情况耗时一致
+        if not verify_password(data.password, user.password if user else None):
+            logger.info("登录失败：用户名或密码错误（用户名 = %s）", data.username)
             raise HTTPException(status_code=401, detail="用户名或密码错误")
         
-        print(f"✅ 登录成功：用户ID = {user.id}, 用户名 = {user.username}")
+        # 历史遗留的明文密码（或过时的哈希参数），登录成功时顺便升级为新哈希
+        if password_needs_rehash(user.password):
+            user.password = hash_password(data.password)
+            session.add(user)
+            session.commit()
+            invalidate_user_cache(user.id)
+        
+        logger.debug("登录成功：用户ID = %s, 用户名 = %s", user.id, user.username)
         
         # 生成JWT token
         # data={"sub": str(user.id)}: token中存储用户ID（必须是字符串）
@@ -527,14 +831,16 @@ def login(data: LoginRequest, session: Session = Depends(get_session)):
         raise
     except Exception as e:
         # 其他异常记录日志并返回500错误
-        print(f"❌ 登录错误: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()  # 打印完整的错误堆栈
+        logger.exception("登录错误: %s: %s", type(e).__name__, e)  # 同时记录完整的错误堆栈
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
-@app.get("/api/auth/user", response_model=dict)
-def get_user_info(current_user: User = Depends(get_current_user)):
+@app.get("/api/auth/user")
+def get_user_info(
+    request: Request,
+    current_user: User = Depends(get_current_user),
+    session: Session = Depends(get_session)
+):
     """
     获取当前登录用户信息
     
@@ -542,7 +848,9 @@ def get_user_info(current_user: User = Depends(get_current_user)):
     从JWT token中解析用户ID，然后查询数据库获取用户详细信息
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - current_user: 当前登录用户（通过get_current_user自动获取）
+    - session: 数据库会话（用于加载认证时延迟的资料字段）
     
     返回：
     - 用户详细信息
@@ -551,7 +859,10 @@ def get_user_info(current_user: User = Depends(get_current_user)):
     - 这个接口需要认证（需要token）
     - get_current_user会自动验证token并获取用户信息
     """
-    return {
+    # 认证时没有加载email、phone等资料字段，这里一次性补齐
+    load_user_profile(session, current_user)
+    
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
@@ -562,14 +873,15 @@ def get_user_info(current_user: User = Depends(get_current_user)):
             "nickname": current_user.nickname,
             "phone": current_user.phone,
             # 将datetime对象转换为ISO格式字符串
-            "createdAt": current_user.created_at.isoformat() if current_user.created_at else "",
-            "updatedAt": current_user.updated_at.isoformat() if current_user.updated_at else ""
+            "createdAt": current_user.created_at or "",
+            "updatedAt": current_user.updated_at or ""
         }
-    }
+    })
 
 
-@app.get("/api/users/{user_id}", response_model=dict)
+@app.get("/api/users/{user_id}")
 def get_user_public_info(
+    request: Request,
     user_id: int,
     session: Session = Depends(get_session)
 ):
@@ -580,6 +892,7 @@ def get_user_public_info(
     获取用户的公开信息（昵称、头像、简介等），用于用户公开主页
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - user_id: 用户ID
     - session: 数据库会话
     
@@ -592,11 +905,13 @@ def get_user_public_info(
         raise HTTPException(status_code=404, detail="用户不存在")
     
     # 统计用户的公开文章数
-    public_notes_count = len(session.exec(
-        select(Note).where(Note.user_id == user_id).where(Note.status == "public")
-    ).all())
+    # 使用 SELECT COUNT(*)，只返回一个数字（走 (user_id, published_at, id) 公开笔记部分索引），不加载笔记正文
+    public_notes_count = session.exec(
+        select(func.count()).select_from(Note)
+        .where(Note.user_id == user_id).where(Note.status == "public").where(Note.published_at.isnot(None))
+    ).one()
     
-    return {
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
@@ -607,10 +922,10 @@ def get_user_public_info(
             "bio": user.bio,
             "public_notes_count": public_notes_count,
         }
-    }
+    }, PUBLIC_CACHE_CONTROL)
 
 
-@app.put("/api/auth/user", response_model=dict)
+@app.put("/api/auth/user")
 def update_user_info(
     data: UserUpdateRequest,
     current_user: User = Depends(get_current_user),
@@ -635,54 +950,52 @@ def update_user_info(
     - 更新时会自动更新updated_at时间戳
     """
     try:
-        # 更新字段（只更新提供的字段）
-        if data.email is not None:
-            current_user.email = data.email
-        if data.nickname is not None:
-            current_user.nickname = data.nickname
-        if data.phone is not None:
-            current_user.phone = data.phone
-        if data.bio is not None:
-            current_user.bio = data.bio
-        if data.location is not None:
-            current_user.location = data.location
-        if data.website is not None:
-            current_user.website = data.website
-        
-        # 更新修改时间
-        current_user.updated_at = datetime.now()
+        # 要更新的字段（只更新提供的字段）
+        changes = data.model_dump(exclude_none=True)
         
-        # 保存更改
-        session.add(current_user)
-        session.commit()
-        session.refresh(current_user)
+        if changes:
+            # 一条 UPDATE ... RETURNING 完成：不需要先 SELECT 补齐资料字段再写回，
+            # 修改时间由列的 onupdate 在 UPDATE 时写入，响应需要的全部字段由 RETURNING 直接带回
+            user = session.exec(
+                update(User)
+                .where(User.id == current_user.id)
+                .values(**changes)
+                .returning(
+                    User.id, User.username, User.email, User.avatar, User.nickname, User.phone,
+                    User.bio, User.location, User.website, User.created_at, User.updated_at,
+                )
+            ).one()
+            session.commit()
+            invalidate_user_cache(current_user.id)
+        else:
+            # 没有要修改的字段：认证时没有加载资料字段，一次性补齐后原样返回
+            load_user_profile(session, current_user)
+            user = current_user
         
         # 返回更新后的用户信息
-        return {
+        return ORJSONResponse(content={
             "code": 200,
             "message": "更新成功",
             "data": {
-                "id": str(current_user.id),
-                "username": current_user.username,
-                "email": current_user.email or "",
-                "avatar": current_user.avatar,
-                "nickname": current_user.nickname,
-                "phone": current_user.phone,
-                "bio": current_user.bio,
-                "location": current_user.location,
-                "website": current_user.website,
-                "createdAt": current_user.created_at.isoformat() if current_user.created_at else "",
-                "updatedAt": current_user.updated_at.isoformat() if current_user.updated_at else ""
+                "id": str(user.id),
+                "username": user.username,
+                "email": user.email or "",
+                "avatar": user.avatar,
+                "nickname": user.nickname,
+                "phone": user.phone,
+                "bio": user.bio,
+                "location": user.location,
+                "website": user.website,
+                "createdAt": user.created_at or "",
+                "updatedAt": user.updated_at or ""
             }
-        }
+        })
     except Exception as e:
-        print(f"更新用户信息错误: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("更新用户信息错误: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
 
 
-@app.post("/api/auth/upload-avatar", response_model=dict)
+@app.post("/api/auth/upload-avatar")
 async def upload_avatar(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
@@ -713,32 +1026,35 @@ async def upload_avatar(
         allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif"]
         if file.content_type not in allowed_types:
             raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
+        # 检查文件内容是否真的是图片（Content-Type 可以伪造）
+        if not is_image_upload(file):
+            raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
         
         # 检查文件大小（5MB限制）
-        file_content = await file.read()
-        if len(file_content) > 5 * 1024 * 1024:  # 5MB
+        # 不把整个文件读入内存，超过限制的文件直接拒绝
+        if get_upload_size(file) > UPLOAD_MAX_SIZE:
             raise HTTPException(status_code=400, detail="文件大小不能超过5MB")
         
-        # 生成文件名（使用用户ID和时间戳）
+        # 生成文件名（使用用户ID、时间戳和随机后缀）
+        # 本地文件名和 Cloudinary 的 public_id 使用同一个后缀
+        upload_suffix = make_upload_suffix()
         file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        filename = f"avatar_{current_user.id}_{int(datetime.now().timestamp())}.{file_extension}"
+        filename = f"avatar_{current_user.id}_{upload_suffix}.{file_extension}"
         
         # 检查是否配置了 Cloudinary（优先使用云存储）
-        cloudinary_cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
-        cloudinary_api_key = os.getenv("CLOUDINARY_API_KEY")
-        cloudinary_api_secret = os.getenv("CLOUDINARY_API_SECRET")
-        
-        if cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret:
+        if USE_CLOUDINARY:
             # ========== 使用 Cloudinary 云存储 ==========
             try:
                 # 上传到 Cloudinary
                 # folder: 指定文件夹路径，便于管理
                 # public_id: 文件的唯一标识（不包含扩展名）
                 # resource_type: 资源类型，image 表示图片
-                upload_result = cloudinary.uploader.upload(
-                    file_content,
+                # cloudinary SDK是同步的HTTPS请求，放到线程池中执行，避免阻塞事件循环（上传期间其他请求照常处理）
+                upload_result = await run_in_threadpool(
+                    cloudinary.uploader.upload,
+                    file.file,  # 直接传文件对象，不额外复制一份内容
                     folder="avatars",  # 存储在 avatars 文件夹下
-                    public_id=f"user_{current_user.id}_{int(datetime.now().timestamp())}",  # 唯一标识
+                    public_id=f"user_{current_user.id}_{upload_suffix}",  # 唯一标识
                     resource_type="image",
                     overwrite=True,  # 如果文件已存在则覆盖
                     transformation=[
@@ -749,18 +1065,16 @@ async def upload_avatar(
                 # Cloudinary 返回的 URL 是完整的 HTTPS URL
                 avatar_url = upload_result.get("secure_url") or upload_result.get("url")
                 
-                print(f"✅ 头像已上传到 Cloudinary: {avatar_url}")
+                logger.info("头像已上传到 Cloudinary: %s", avatar_url)
                 
             except Exception as cloudinary_error:
-                print(f"❌ Cloudinary 上传失败: {type(cloudinary_error).__name__}: {str(cloudinary_error)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Cloudinary 上传失败: %s: %s", type(cloudinary_error).__name__, cloudinary_error)
                 raise HTTPException(
                     status_code=500,
                     detail=f"云存储上传失败: {str(cloudinary_error)}"
                 )
         
-        elif os.getenv("VERCEL"):
+        elif IS_VERCEL:
             # ========== Vercel 环境但没有配置 Cloudinary ==========
             raise HTTPException(
                 status_code=503,
@@ -776,39 +1090,35 @@ async def upload_avatar(
             file_path = upload_dir / filename
             
             # 保存文件
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
+            await run_in_threadpool(save_upload_file, file, file_path)
             
             # 生成访问URL（相对路径，前端需要配置静态文件服务）
             avatar_url = f"/uploads/avatars/{filename}"
             
-            print(f"✅ 头像已保存到本地: {avatar_url}")
+            logger.info("头像已保存到本地: %s", avatar_url)
         
         # 更新用户头像URL
         current_user.avatar = avatar_url
-        current_user.updated_at = datetime.now()
         session.add(current_user)
         session.commit()
-        session.refresh(current_user)
+        invalidate_user_cache(current_user.id)
         
-        return {
+        return ORJSONResponse(content={
             "code": 200,
             "message": "上传成功",
             "data": {
                 "avatar": avatar_url,
                 "url": avatar_url  # 兼容性字段
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        print(f"上传头像失败: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("上传头像失败: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
-@app.post("/api/notes/upload-image", response_model=dict)
+@app.post("/api/notes/upload-image")
 async def upload_note_image(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
@@ -840,30 +1150,33 @@ async def upload_note_image(
         allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif"]
         if file.content_type not in allowed_types:
             raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
+        # 检查文件内容是否真的是图片（Content-Type 可以伪造）
+        if not is_image_upload(file):
+            raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
         
         # 检查文件大小（5MB限制）
-        file_content = await file.read()
-        if len(file_content) > 5 * 1024 * 1024:  # 5MB
+        # 不把整个文件读入内存，超过限制的文件直接拒绝
+        if get_upload_size(file) > UPLOAD_MAX_SIZE:
             raise HTTPException(status_code=400, detail="文件大小不能超过5MB")
         
-        # 生成文件名（使用用户ID和时间戳）
+        # 生成文件名（使用用户ID、时间戳和随机后缀）
+        # 本地文件名和 Cloudinary 的 public_id 使用同一个后缀
+        upload_suffix = make_upload_suffix()
         file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        filename = f"note_{current_user.id}_{int(datetime.now().timestamp())}.{file_extension}"
+        filename = f"note_{current_user.id}_{upload_suffix}.{file_extension}"
         
         # 检查是否配置了 Cloudinary（优先使用云存储）
-        cloudinary_cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
-        cloudinary_api_key = os.getenv("CLOUDINARY_API_KEY")
-        cloudinary_api_secret = os.getenv("CLOUDINARY_API_SECRET")
-        
-        if cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret:
+        if USE_CLOUDINARY:
             # ========== 使用 Cloudinary 云存储 ==========
             try:
                 # 上传到 Cloudinary
                 # folder: 指定文件夹路径，便于管理（使用 notes 文件夹）
-                upload_result = cloudinary.uploader.upload(
-                    file_content,
+                # cloudinary SDK是同步的HTTPS请求，放到线程池中执行，避免阻塞事件循环（上传期间其他请求照常处理）
+                upload_result = await run_in_threadpool(
+                    cloudinary.uploader.upload,
+                    file.file,  # 直接传文件对象，不额外复制一份内容
                     folder="notes",  # 存储在 notes 文件夹下
-                    public_id=f"note_{current_user.id}_{int(datetime.now().timestamp())}",  # 唯一标识
+                    public_id=f"note_{current_user.id}_{upload_suffix}",  # 唯一标识
                     resource_type="image",
                     overwrite=False,  # 不覆盖，允许同名文件
                 )
@@ -871,18 +1184,16 @@ async def upload_note_image(
                 # Cloudinary 返回的 URL 是完整的 HTTPS URL
                 image_url = upload_result.get("secure_url") or upload_result.get("url")
                 
-                print(f"✅ 笔记图片已上传到 Cloudinary: {image_url}")
+                logger.info("笔记图片已上传到 Cloudinary: %s", image_url)
                 
             except Exception as cloudinary_error:
-                print(f"❌ Cloudinary 上传失败: {type(cloudinary_error).__name__}: {str(cloudinary_error)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Cloudinary 上传失败: %s: %s", type(cloudinary_error).__name__, cloudinary_error)
                 raise HTTPException(
                     status_code=500,
                     detail=f"云存储上传失败: {str(cloudinary_error)}"
                 )
         
-        elif os.getenv("VERCEL"):
+        elif IS_VERCEL:
             # ========== Vercel 环境但没有配置 Cloudinary ==========
             raise HTTPException(
                 status_code=503,
@@ -898,33 +1209,30 @@ async def upload_note_image(
             file_path = upload_dir / filename
             
             # 保存文件
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
+            await run_in_threadpool(save_upload_file, file, file_path)
             
             # 生成访问URL（相对路径，前端需要配置静态文件服务）
             image_url = f"/uploads/notes/{filename}"
             
-            print(f"✅ 笔记图片已保存到本地: {image_url}")
+            logger.info("笔记图片已保存到本地: %s", image_url)
         
         # 注意：这里不更新用户头像，只返回图片URL
-        return {
+        return ORJSONResponse(content={
             "code": 200,
             "message": "上传成功",
             "data": {
                 "url": image_url,
                 "image": image_url  # 兼容性字段
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        print(f"上传笔记图片失败: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("上传笔记图片失败: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
-@app.post("/api/auth/logout", response_model=dict)
+@app.post("/api/auth/logout")
 def logout():
     """
     退出登录接口
@@ -940,21 +1248,155 @@ def logout():
     - 真正的退出登录是前端删除token
     - 这个接口主要是为了API设计的完整性
     """
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "退出成功",
         "data": {}
-    }
+    })
+
+
+# ==================== 游标分页 ====================
+# 列表接口除了 page 页码分页外，还支持游标（keyset）分页：
+# - OFFSET 分页翻到第N页时，数据库要先读出并丢弃前面 (N-1)*page_size 行，越往后越慢
+# - 游标分页记住上一页最后一条的 (排序时间, id)，下一页直接从索引中这个位置之后开始读
+# 
+# 用法：第一页不传 cursor，之后每次把响应中的 next_cursor 原样作为 cursor 传回，
+# next_cursor 为 null 表示没有更多数据；不传 cursor 时仍按 page 分页（兼容旧前端）
+
+def encode_cursor(sort_time: datetime, note_id: int) -> str:
+    """把上一页最后一条记录的 (排序时间, id) 编码为游标字符串"""
+    return f"{sort_time.isoformat()}_{note_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """解析游标字符串，格式不正确时返回400"""
+    try:
+        sort_time, note_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(sort_time), int(note_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="无效的分页游标") from None
+
+
+# ==================== 公开内容响应缓存 ====================
+# 发现广场、用户公开文章列表都是公开的、读多写少的数据，所有访客看到的内容相同，
+# 这里把这些接口的响应（已序列化的JSON）在进程内缓存一小段时间，命中时不查询数据库
+# 
+# 缓存key（元组）：
+# - ("discover", page, page_size): 发现广场列表（不带搜索条件和游标）
+# - ("user_notes", user_id, page, page_size): 用户公开文章列表
+# 
+# 一致性：
+# - 本进程内笔记发生新建/修改/发布/删除等变化，或公开笔记的喜爱/收藏/评论发生变化时，
+#   调用invalidate_public_cache立即清除相关条目
+# - 其他进程（多worker）中的变化不会清除本进程的缓存，最多在PUBLIC_CACHE_TTL_SECONDS秒后更新：
+#   这段时间内列表中的喜爱数、收藏数、评论数、作者资料可能是旧的，
+#   已取消公开或已删除的笔记也可能仍出现在列表中（标题和内容摘要）
+# - 公开笔记详情包含完整正文，不做进程内缓存：每次都查询数据库确认笔记仍是公开状态，
+#   否则笔记取消公开/删除后，其他进程还会继续返回全文
+# 
+# 协商缓存：
+# - 响应带 ETag（响应体的 blake2b 摘要），客户端下次请求带上 If-None-Match，
+#   内容没有变化时直接返回 304 Not Modified，不再传输响应体
+# - Cache-Control: public, no-cache：允许浏览器和CDN保存响应，但每次使用前都要带 ETag 回源验证，
+#   内容没有变化时只需要一个空的304；不设置 max-age，作者发布/修改笔记后刷新页面能立即看到变化
+#   （不会在浏览器中继续使用旧的列表）
+PUBLIC_CACHE_CONTROL = "public, no-cache"
+
+# 需要登录或带有当前用户状态的接口：只允许浏览器保存（共享缓存/CDN不能保存），同样每次回源验证
+# 这类响应同时带 Vary: Authorization，同一个浏览器切换账号后不会用到上一个账号的缓存
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+# 缓存有效期（秒）
+PUBLIC_CACHE_TTL_SECONDS = 30
+
+# 缓存最大条目数（超出后按插入顺序淘汰）
+PUBLIC_CACHE_MAX_SIZE = 1024
+
+# 缓存条目：(响应体, ETag, 过期时间)
+_public_cache: Dict[tuple, Tuple[bytes, str, float]] = {}
+_public_cache_lock = threading.Lock()
+
+
+def make_etag(body: bytes) -> str:
+    """根据响应体生成ETag（blake2b 8字节摘要，带引号）"""
+    return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """客户端的If-None-Match中是否包含该ETag（客户端缓存的内容没有变化）"""
+    if_none_match = request.headers.get("if-none-match")
+    return bool(if_none_match) and etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+
+
+def build_cached_response(
+    request: Request, body: bytes, etag: str, cache_control: str = PUBLIC_CACHE_CONTROL
+) -> Response:
+    """
+    构建带ETag的响应
+    
+    客户端的If-None-Match与ETag一致时返回304（没有响应体），否则返回完整的JSON响应体
+    """
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if cache_control.startswith("private"):
+        headers["Vary"] = "Authorization"
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def etag_response(request: Request, content: dict, cache_control: str = PRIVATE_CACHE_CONTROL) -> Response:
+    """
+    用orjson序列化响应内容并返回带ETag的响应（不写入进程内缓存）
+    
+    用于不适合进程内缓存的接口（按用户区分、或写入后需要立即可见）：
+    仍然要查询数据库和序列化，但内容没有变化时只返回304，不再传输响应体
+    """
+    body = orjson.dumps(content)
+    return build_cached_response(request, body, make_etag(body), cache_control)
+
+
+def get_cached_response(request: Request, cache_key: tuple) -> Optional[Response]:
+    """查询缓存，命中且未过期时返回缓存的响应（或304），否则返回None"""
+    cached = _public_cache.get(cache_key)
+    if cached is not None and cached[2] > time.time():
+        return build_cached_response(request, cached[0], cached[1])
+    return None
+
+
+def cache_response(request: Request, cache_key: tuple, content: dict) -> Response:
+    """用orjson序列化响应内容，写入缓存并返回响应"""
+    body = orjson.dumps(content)
+    etag = make_etag(body)
+    with _public_cache_lock:
+        if len(_public_cache) >= PUBLIC_CACHE_MAX_SIZE and cache_key not in _public_cache:
+            # dict保持插入顺序，第一个key就是最早插入的条目
+            _public_cache.pop(next(iter(_public_cache)), None)
+        _public_cache[cache_key] = (body, etag, time.time() + PUBLIC_CACHE_TTL_SECONDS)
+    return build_cached_response(request, body, etag)
+
+
+def invalidate_public_cache(user_id: int) -> None:
+    """
+    笔记发生变化后调用，清除相关的缓存条目
+    
+    清除：发现广场列表（全部）、该笔记作者的公开文章列表
+    """
+    with _public_cache_lock:
+        for key in list(_public_cache):
+            if key[0] == "discover" or (key[0] == "user_notes" and key[1] == user_id):
+                _public_cache.pop(key, None)
 
 
 # ==================== 笔记相关接口 ====================
 
-@app.get("/api/notes", response_model=dict)
+@app.get("/api/notes")
 def get_notes(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     search: Optional[str] = None,
     status: Optional[str] = None,
+    cursor: Optional[str] = None,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
 ):
@@ -968,21 +1410,33 @@ def get_notes(
     4. 支持按状态筛选（private/public/draft）
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - page: 页码，从1开始
     - page_size: 每页记录数
     - search: 搜索关键词（标题模糊搜索）
     - status: 状态筛选（private/public/draft）
+    - cursor: 分页游标（上一页返回的 next_cursor），传入时忽略 page
     - current_user: 当前登录用户（自动注入）
     - session: 数据库会话（自动注入）
     
     返回：
-    - 笔记列表和分页信息
+    - 笔记列表和分页信息（next_cursor: 下一页游标，没有更多数据时为 null）
     """
     offset = (page - 1) * page_size
     
     # 构建查询语句：查询当前用户的所有笔记
-    statement = select(Note).where(Note.user_id == current_user.id)
-    total_statement = select(Note).where(Note.user_id == current_user.id)
+    # 只查询列表需要的列，返回轻量的行元组，不构建完整的 Note ORM 对象；
+    # 正文只取开头用于生成预览的部分，不传输整篇正文
+    # 总数使用 SELECT COUNT(*)，只返回一个数字，不把所有行都加载到内存中
+    statement = select(
+        Note.id,
+        Note.title,
+        func.substr(Note.content, 1, CONTENT_PREVIEW_SOURCE_LENGTH).label("content"),
+        Note.status,
+        Note.updated_at,
+        Note.created_at,
+    ).where(Note.user_id == current_user.id)
+    total_statement = select(func.count()).select_from(Note).where(Note.user_id == current_user.id)
     
     # 状态筛选
     if status and status in ["private", "public", "draft"]:
@@ -996,42 +1450,55 @@ def get_notes(
         total_statement = total_statement.where(Note.title.like(search_term))
     
     # 执行分页查询
-    notes = session.exec(statement.order_by(Note.updated_at.desc()).offset(offset).limit(page_size)).all()
-    # 统计总数
-    total_notes = session.exec(total_statement).all()
-    total = len(total_notes)
+    # 有游标时从上一页最后一条之后开始读（走 (user_id, updated_at) 索引），总数单独 COUNT(*) 统计
+    # （游标条件会缩小统计范围，不能和列表放在同一条查询中）；
+    # 否则按页码 OFFSET，并用窗口函数 COUNT(*) OVER () 在同一条查询中带出总数，少一次数据库往返
+    page_statement = statement.order_by(Note.updated_at.desc(), Note.id.desc()).limit(page_size)
+    if cursor:
+        page_statement = page_statement.where(tuple_(Note.updated_at, Note.id) < decode_cursor(cursor))
+        notes = session.exec(page_statement).all()
+        total = session.exec(total_statement).one()
+    else:
+        page_statement = page_statement.add_columns(func.count().over().label("total_count")).offset(offset)
+        notes = session.exec(page_statement).all()
+        if notes:
+            total = notes[0].total_count
+        else:
+            # 页码超出范围时没有返回任何行，取不到窗口函数的结果，再单独统计总数
+            total = session.exec(total_statement).one() if offset else 0
     
     # 转换为字典格式
     notes_list = []
     for note in notes:
         # 提取内容预览（前50字符，去除HTML标签）
-        content_preview = note.content[:50] if note.content else ""
-        # 简单去除HTML标签
-        content_preview = re.sub(r'<[^>]+>', '', content_preview)
+        content_preview = make_content_preview(note.content)
         
         notes_list.append({
             "id": str(note.id),
             "title": note.title,
             "content_preview": content_preview,
             "status": note.status,
-            "updated_at": note.updated_at.isoformat() if note.updated_at else "",
-            "created_at": note.created_at.isoformat() if note.created_at else "",
+            "updated_at": note.updated_at or "",
+            "created_at": note.created_at or "",
         })
     
-    return {
+    # 列表数据量大，直接返回ORJSONResponse，跳过response_model的校验和jsonable_encoder转换
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
             "list": notes_list,
             "total": total,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": encode_cursor(notes[-1].updated_at, notes[-1].id) if notes and len(notes) == page_size else None
         }
-    }
+    })
 
 
-@app.get("/api/notes/{note_id}", response_model=dict)
+@app.get("/api/notes/{note_id}")
 def get_note_by_id(
+    request: Request,
     note_id: int,
     current_user: User = Depends(get_current_user),
     session: Session = Depends(get_session)
@@ -1043,23 +1510,30 @@ def get_note_by_id(
     根据笔记ID获取笔记详情，只能获取当前用户自己的笔记
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - note_id: 笔记ID（路径参数）
     - current_user: 当前登录用户
     - session: 数据库会话
     
     返回：
-    - 笔记详情
+    - 笔记详情（内容没有变化时返回304）
     
     注意：
     - 如果笔记不存在或不属于当前用户，返回404错误
     """
-    note = session.get(Note, note_id)
+    # 查询笔记（不存在或不属于当前用户时返回404）
+    note = get_own_note(session, note_id, current_user.id)
     
-    # 检查笔记是否存在且属于当前用户
-    if not note or note.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="笔记不存在")
+    # 协商缓存：笔记的每次修改（编辑、发布、存草稿、自动保存）都会更新 updated_at，
+    # 用 (笔记ID, updated_at) 生成ETag，不需要先序列化整篇正文再计算摘要
+    # 客户端缓存的内容没有变化时返回304，不再传输正文
+    # 笔记是私有内容，Cache-Control: private 禁止CDN/代理缓存，no-cache 要求浏览器每次使用前都重新验证
+    etag = make_etag(f"{note.id}:{note.updated_at}".encode())
+    cache_headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=cache_headers)
     
-    return {
+    return ORJSONResponse(headers=cache_headers, content={
         "code": 200,
         "message": "success",
         "data": {
@@ -1068,14 +1542,14 @@ def get_note_by_id(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else ""
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or ""
         }
-    }
+    })
 
 
-@app.post("/api/notes", response_model=dict)
+@app.post("/api/notes")
 def create_note(
     data: NoteCreate,
     current_user: User = Depends(get_current_user),
@@ -1111,12 +1585,12 @@ def create_note(
     if new_note.status == "public":
         new_note.published_at = datetime.now()
     
-    # 保存到数据库
+    # 保存到数据库（id 由数据库生成后写回对象，创建/更新时间由列默认值在写入前生成，不需要再 refresh）
     session.add(new_note)
     session.commit()
-    session.refresh(new_note)
+    invalidate_public_cache(new_note.user_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "创建成功",
         "data": {
@@ -1125,14 +1599,14 @@ def create_note(
             "title": new_note.title,
             "content": new_note.content,
             "status": new_note.status,
-            "published_at": new_note.published_at.isoformat() if new_note.published_at else None,
-            "created_at": new_note.created_at.isoformat() if new_note.created_at else "",
-            "updated_at": new_note.updated_at.isoformat() if new_note.updated_at else ""
+            "published_at": new_note.published_at,
+            "created_at": new_note.created_at or "",
+            "updated_at": new_note.updated_at or ""
         }
-    }
+    })
 
 
-@app.put("/api/notes/{note_id}", response_model=dict)
+@app.put("/api/notes/{note_id}")
 def update_note(
     note_id: int,
     data: NoteUpdate,
@@ -1159,11 +1633,8 @@ def update_note(
     - 更新时会自动更新updated_at时间戳
     - 如果状态改为public，会自动设置published_at
     """
-    note = session.get(Note, note_id)
-    
-    # 检查笔记是否存在且属于当前用户
-    if not note or note.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="笔记不存在")
+    # 查询笔记（不存在或不属于当前用户时返回404）
+    note = get_own_note(session, note_id, current_user.id)
     
     # 更新字段
     if data.title is not None:
@@ -1179,15 +1650,12 @@ def update_note(
         elif data.status in ["private", "draft"]:
             note.published_at = None
     
-    # 更新修改时间
-    note.updated_at = datetime.now()
-    
-    # 保存更改
+    # 保存更改（修改时间由列的 onupdate 在 UPDATE 时写入）
     session.add(note)
     session.commit()
-    session.refresh(note)
+    invalidate_public_cache(note.user_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "更新成功",
         "data": {
@@ -1196,14 +1664,14 @@ def update_note(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else ""
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or ""
         }
-    }
+    })
 
 
-@app.delete("/api/notes/{note_id}", response_model=dict)
+@app.delete("/api/notes/{note_id}")
 def delete_note(
     note_id: int,
     current_user: User = Depends(get_current_user),
@@ -1223,24 +1691,24 @@ def delete_note(
     返回：
     - 删除成功消息
     """
-    note = session.get(Note, note_id)
+    # 删除笔记：一条 DELETE 完成，归属检查放在 WHERE 条件中，不需要先 SELECT 出整篇笔记
+    deleted = session.exec(delete(Note).where(Note.id == note_id).where(Note.user_id == current_user.id))
     
-    # 检查笔记是否存在且属于当前用户
-    if not note or note.user_id != current_user.id:
+    # 没有删除任何行：笔记不存在或不属于当前用户
+    if not deleted.rowcount:
         raise HTTPException(status_code=404, detail="笔记不存在")
     
-    # 删除笔记
-    session.delete(note)
     session.commit()
+    invalidate_public_cache(current_user.id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "删除成功",
         "data": {}
-    }
+    })
 
 
-@app.put("/api/notes/{note_id}/publish", response_model=dict)
+@app.put("/api/notes/{note_id}/publish")
 def publish_note(
     note_id: int,
     current_user: User = Depends(get_current_user),
@@ -1260,20 +1728,17 @@ def publish_note(
     返回：
     - 更新后的笔记信息
     """
-    note = session.get(Note, note_id)
-    
-    if not note or note.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="笔记不存在")
+    # 查询笔记（不存在或不属于当前用户时返回404）
+    note = get_own_note(session, note_id, current_user.id)
     
     note.status = "public"
     note.published_at = datetime.now()
-    note.updated_at = datetime.now()
     
     session.add(note)
     session.commit()
-    session.refresh(note)
+    invalidate_public_cache(note.user_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "发布成功",
         "data": {
@@ -1282,14 +1747,14 @@ def publish_note(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else ""
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or ""
         }
-    }
+    })
 
 
-@app.put("/api/notes/{note_id}/draft", response_model=dict)
+@app.put("/api/notes/{note_id}/draft")
 def save_note_as_draft(
     note_id: int,
     current_user: User = Depends(get_current_user),
@@ -1309,20 +1774,17 @@ def save_note_as_draft(
     返回：
     - 更新后的笔记信息
     """
-    note = session.get(Note, note_id)
-    
-    if not note or note.user_id != current_user.id:
-        raise HTTPException(status_code=404, detail="笔记不存在")
+    # 查询笔记（不存在或不属于当前用户时返回404）
+    note = get_own_note(session, note_id, current_user.id)
     
     note.status = "draft"
     note.published_at = None
-    note.updated_at = datetime.now()
     
     session.add(note)
     session.commit()
-    session.refresh(note)
+    invalidate_public_cache(note.user_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "已存为草稿",
         "data": {
@@ -1331,14 +1793,14 @@ def save_note_as_draft(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else ""
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or ""
         }
-    }
+    })
 
 
-@app.put("/api/notes/{note_id}/autosave", response_model=dict)
+@app.put("/api/notes/{note_id}/autosave")
 def autosave_note(
     note_id: int,
     data: NoteAutoSave,
@@ -1360,19 +1822,29 @@ def autosave_note(
     返回：
     - 更新后的笔记信息
     """
-    note = session.get(Note, note_id)
+    # 自动保存由编辑器频繁触发，这里用一条 UPDATE ... RETURNING 完成：
+    # 不需要先 SELECT 出整篇笔记（包括旧的正文）再写回，归属检查放在 WHERE 条件中，
+    # 响应需要的其他字段由 RETURNING 直接带回，每次自动保存只有一次数据库往返
+    note = session.exec(
+        update(Note)
+        .where(Note.id == note_id).where(Note.user_id == current_user.id)
+        .values(content=data.content)
+        .returning(
+            Note.id, Note.user_id, Note.title, Note.content, Note.status,
+            Note.published_at, Note.created_at, Note.updated_at,
+        )
+    ).first()
     
-    if not note or note.user_id != current_user.id:
+    # 没有更新任何行：笔记不存在或不属于当前用户
+    if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
     
-    note.content = data.content
-    note.updated_at = datetime.now()
-    
-    session.add(note)
     session.commit()
-    session.refresh(note)
+    # 只有公开笔记会出现在公开内容缓存中
+    if note.status == "public":
+        invalidate_public_cache(note.user_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "保存成功",
         "data": {
@@ -1381,20 +1853,22 @@ def autosave_note(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else ""
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or ""
         }
-    }
+    })
 
 
 # ==================== 发现广场相关接口 ====================
 
-@app.get("/api/discover", response_model=dict)
+@app.get("/api/discover")
 def get_discover_notes(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     search: Optional[str] = None,
+    cursor: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
     """
@@ -1408,16 +1882,44 @@ def get_discover_notes(
     - page: 页码
     - page_size: 每页记录数
     - search: 搜索关键词（标题模糊搜索）
+    - cursor: 分页游标（上一页返回的 next_cursor），传入时忽略 page
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - session: 数据库会话
     
     返回：
-    - 公开笔记列表和分页信息
+    - 公开笔记列表和分页信息（next_cursor: 下一页游标，没有更多数据时为 null）
     """
+    # 不带搜索条件和游标的列表优先从缓存返回
+    cache_key = ("discover", page, page_size) if not search and not cursor else None
+    if cache_key is not None:
+        cached_response = get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+    
     offset = (page - 1) * page_size
     
     # 查询所有公开的笔记，按发布时间倒序
-    statement = select(Note).where(Note.status == "public").where(Note.published_at.isnot(None))
-    total_statement = select(Note).where(Note.status == "public").where(Note.published_at.isnot(None))
+    # 只查询列表需要的列，返回轻量的行元组，不构建完整的 Note ORM 对象；
+    # 正文只取开头用于生成预览的部分，不传输整篇正文
+    # 通过 LEFT JOIN 一次性取出笔记和作者，避免每条笔记再单独查询一次作者（N+1 查询）
+    # 作者只取展示需要的列（AUTHOR_COLUMNS），不加载整行 User
+    statement = (
+        select(
+            Note.id,
+            Note.title,
+            func.substr(Note.content, 1, CONTENT_PREVIEW_SOURCE_LENGTH).label("content"),
+            Note.published_at,
+            Note.created_at,
+            *AUTHOR_COLUMNS,
+        )
+        .join(User, User.id == Note.user_id, isouter=True)
+        .where(Note.status == "public").where(Note.published_at.isnot(None))
+    )
+    # 总数使用 SELECT COUNT(*)，只返回一个数字
+    total_statement = (
+        select(func.count()).select_from(Note)
+        .where(Note.status == "public").where(Note.published_at.isnot(None))
+    )
     
     # 标题搜索（模糊匹配）
     if search and search.strip():
@@ -1426,57 +1928,60 @@ def get_discover_notes(
         total_statement = total_statement.where(Note.title.like(search_term))
     
     # 执行分页查询
-    notes = session.exec(
-        statement.order_by(Note.published_at.desc()).offset(offset).limit(page_size)
-    ).all()
-    total_notes = session.exec(total_statement).all()
-    total = len(total_notes)
+    # 有游标时从上一页最后一条之后开始读（走 (status, published_at) 索引），否则按页码 OFFSET
+    page_statement = statement.order_by(Note.published_at.desc(), Note.id.desc()).limit(page_size)
+    if cursor:
+        page_statement = page_statement.where(tuple_(Note.published_at, Note.id) < decode_cursor(cursor))
+    else:
+        page_statement = page_statement.offset(offset)
+    rows = session.exec(page_statement).all()
+    total = session.exec(total_statement).one()
+    
+    # 获取统计数据（喜爱数、收藏数、评论数）
+    # 整页笔记一起统计：每种数据一条 GROUP BY 查询（走 (note_id, ...) 索引），不再每篇笔记查询三次
+    note_ids = [note.id for note in rows]
+    like_counts = count_by_note(session, Like, note_ids)
+    favorite_counts = count_by_note(session, Favorite, note_ids)
+    comment_counts = count_by_note(session, Comment, note_ids)
     
     # 转换为字典格式
     notes_list = []
-    for note in notes:
-        # 获取作者信息
-        author = session.get(User, note.user_id)
-        
+    for note in rows:
         # 提取内容预览（前50字符）
-        content_preview = note.content[:50] if note.content else ""
-        content_preview = re.sub(r'<[^>]+>', '', content_preview)
-        
-        # 获取统计数据（喜爱数、收藏数、评论数）
-        like_count = len(session.exec(select(Like).where(Like.note_id == note.id)).all())
-        favorite_count = len(session.exec(select(Favorite).where(Favorite.note_id == note.id)).all())
-        comment_count = len(session.exec(select(Comment).where(Comment.note_id == note.id)).all())
+        content_preview = make_content_preview(note.content)
         
         notes_list.append({
             "id": str(note.id),
             "title": note.title,
             "content_preview": content_preview,
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            },
-            "published_at": note.published_at.isoformat() if note.published_at else "",
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "like_count": like_count,
-            "favorite_count": favorite_count,
-            "comment_count": comment_count,
+            "author": build_author_info_from_row(note) or EMPTY_AUTHOR_INFO,
+            "published_at": note.published_at or "",
+            "created_at": note.created_at or "",
+            "like_count": like_counts.get(note.id, 0),
+            "favorite_count": favorite_counts.get(note.id, 0),
+            "comment_count": comment_counts.get(note.id, 0),
         })
     
-    return {
+    # 列表数据量大，直接用orjson序列化后返回，跳过response_model的校验和jsonable_encoder转换
+    content = {
         "code": 200,
         "message": "success",
         "data": {
             "list": notes_list,
             "total": total,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": encode_cursor(rows[-1].published_at, rows[-1].id) if rows and len(rows) == page_size else None
         }
     }
+    if cache_key is not None:
+        return cache_response(request, cache_key, content)
+    return ORJSONResponse(content=content)
 
 
-@app.get("/api/discover/{note_id}", response_model=dict)
+@app.get("/api/discover/{note_id}")
 def get_public_note_by_id(
+    request: Request,
     note_id: int,
     session: Session = Depends(get_session)
 ):
@@ -1488,6 +1993,7 @@ def get_public_note_by_id(
     
     参数：
     - note_id: 笔记ID
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - session: 数据库会话
     
     返回：
@@ -1496,15 +2002,21 @@ def get_public_note_by_id(
     注意：
     - 只能获取状态为"public"的笔记
     """
-    note = session.get(Note, note_id)
+    # 详情包含完整正文，不使用进程内缓存（见“公开内容响应缓存”）：每次都确认笔记仍是公开状态
+    # 公开状态的判断放在SQL条件中：笔记不存在或未公开时数据库直接返回空结果
+    # 通过 LEFT JOIN 在同一条查询中带出作者的展示字段（AUTHOR_COLUMNS），不加载整行 User
+    row = session.exec(
+        select(Note, *AUTHOR_COLUMNS)
+        .join(User, User.id == Note.user_id, isouter=True)
+        .where(Note.id == note_id).where(Note.status == "public")
+    ).first()
     
-    if not note or note.status != "public":
+    if not row:
         raise HTTPException(status_code=404, detail="笔记不存在或未公开")
+    note = row.Note
     
-    # 获取作者信息
-    author = session.get(User, note.user_id)
-    
-    return {
+    # 内容没有变化时（If-None-Match 与 ETag 一致）只返回304，不再传输正文
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
@@ -1513,23 +2025,21 @@ def get_public_note_by_id(
             "title": note.title,
             "content": note.content,
             "status": note.status,
-            "published_at": note.published_at.isoformat() if note.published_at else None,
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "updated_at": note.updated_at.isoformat() if note.updated_at else "",
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            } if author else None
+            "published_at": note.published_at,
+            "created_at": note.created_at or "",
+            "updated_at": note.updated_at or "",
+            "author": build_author_info_from_row(row)
         }
-    }
+    }, PUBLIC_CACHE_CONTROL)
 
 
-@app.get("/api/users/{user_id}/notes", response_model=dict)
+@app.get("/api/users/{user_id}/notes")
 def get_user_public_notes(
+    request: Request,
     user_id: int,
     page: int = 1,
     page_size: int = 20,
+    cursor: Optional[str] = None,
     session: Session = Depends(get_session)
 ):
     """
@@ -1542,63 +2052,93 @@ def get_user_public_notes(
     - user_id: 用户ID
     - page: 页码
     - page_size: 每页记录数
+    - cursor: 分页游标（上一页返回的 next_cursor），传入时忽略 page
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - session: 数据库会话
     
     返回：
-    - 公开文章列表和分页信息
+    - 公开文章列表和分页信息（next_cursor: 下一页游标，没有更多数据时为 null）
     """
+    # 不带游标的列表优先从缓存返回
+    cache_key = ("user_notes", user_id, page, page_size) if not cursor else None
+    if cache_key is not None:
+        cached_response = get_cached_response(request, cache_key)
+        if cached_response is not None:
+            return cached_response
+    
     offset = (page - 1) * page_size
     
     # 查询指定用户的公开笔记
-    statement = select(Note).where(Note.user_id == user_id).where(Note.status == "public")
-    total_statement = select(Note).where(Note.user_id == user_id).where(Note.status == "public")
+    # 只查询列表需要的列，返回轻量的行元组，不构建完整的 Note ORM 对象；
+    # 正文只取开头用于生成预览的部分，不传输整篇正文
+    # 通过 LEFT JOIN 在同一条查询中带出作者的展示字段，不需要再单独查询作者
+    statement = (
+        select(
+            Note.id,
+            Note.title,
+            func.substr(Note.content, 1, CONTENT_PREVIEW_SOURCE_LENGTH).label("content"),
+            Note.published_at,
+            Note.created_at,
+            *AUTHOR_COLUMNS,
+        )
+        .join(User, User.id == Note.user_id, isouter=True)
+        .where(Note.user_id == user_id).where(Note.status == "public").where(Note.published_at.isnot(None))
+    )
+    # 总数使用 SELECT COUNT(*)，只返回一个数字，不把所有行都加载到内存中
+    # 与发现广场相同，没有发布时间的公开笔记不参与排序和游标分页，列表和总数都不包含它们
+    total_statement = (
+        select(func.count()).select_from(Note)
+        .where(Note.user_id == user_id).where(Note.status == "public").where(Note.published_at.isnot(None))
+    )
     
     # 执行分页查询
-    notes = session.exec(
-        statement.order_by(Note.published_at.desc()).offset(offset).limit(page_size)
-    ).all()
-    total_notes = session.exec(total_statement).all()
-    total = len(total_notes)
+    # 有游标时从上一页最后一条之后开始读（走 (user_id, published_at, id) 部分索引），否则按页码 OFFSET
+    page_statement = statement.order_by(Note.published_at.desc(), Note.id.desc()).limit(page_size)
+    if cursor:
+        page_statement = page_statement.where(tuple_(Note.published_at, Note.id) < decode_cursor(cursor))
+    else:
+        page_statement = page_statement.offset(offset)
+    notes = session.exec(page_statement).all()
+    total = session.exec(total_statement).one()
+    
+    # 作者信息
+    # 列表中所有笔记都属于同一个用户（user_id），取第一行中的作者字段构建一次即可
+    author_info = (build_author_info_from_row(notes[0]) if notes else None) or EMPTY_AUTHOR_INFO
     
     # 转换为字典格式
     notes_list = []
     for note in notes:
-        # 获取作者信息
-        author = session.get(User, note.user_id)
-        
         # 提取内容预览
-        content_preview = note.content[:50] if note.content else ""
-        import re
-        content_preview = re.sub(r'<[^>]+>', '', content_preview)
+        content_preview = make_content_preview(note.content)
         
         notes_list.append({
             "id": str(note.id),
             "title": note.title,
             "content_preview": content_preview,
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            },
-            "published_at": note.published_at.isoformat() if note.published_at else "",
-            "created_at": note.created_at.isoformat() if note.created_at else "",
+            "author": author_info,
+            "published_at": note.published_at or "",
+            "created_at": note.created_at or "",
         })
     
-    return {
+    content = {
         "code": 200,
         "message": "success",
         "data": {
             "list": notes_list,
             "total": total,
             "page": page,
-            "page_size": page_size
+            "page_size": page_size,
+            "next_cursor": encode_cursor(notes[-1].published_at, notes[-1].id) if notes and len(notes) == page_size else None
         }
     }
+    if cache_key is not None:
+        return cache_response(request, cache_key, content)
+    return ORJSONResponse(content=content)
 
 
 # ==================== 喜爱（点赞）相关接口 ====================
 
-@app.post("/api/notes/{note_id}/like", response_model=dict)
+@app.post("/api/notes/{note_id}/like")
 def toggle_like(
     note_id: int,
     current_user: User = Depends(get_current_user),
@@ -1619,46 +2159,31 @@ def toggle_like(
     - 操作结果和当前点赞状态
     """
     # 检查笔记是否存在
-    note = session.get(Note, note_id)
+    note = find_note_owner(session, note_id)
     if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
     
-    # 检查是否已点赞
-    existing_like = session.exec(
-        select(Like).where(Like.user_id == current_user.id).where(Like.note_id == note_id)
-    ).first()
-    
-    if existing_like:
-        # 已点赞，取消点赞
-        session.delete(existing_like)
-        session.commit()
-        is_liked = False
-        action = "取消点赞"
-    else:
-        # 未点赞，添加点赞
-        new_like = Like(user_id=current_user.id, note_id=note_id)
-        session.add(new_like)
-        session.commit()
-        is_liked = True
-        action = "点赞成功"
+    # 已点赞则取消点赞，未点赞则添加点赞
+    is_liked = toggle_user_note_record(session, Like, current_user.id, note_id)
+    action = "点赞成功" if is_liked else "取消点赞"
+    # 公开笔记的喜爱数会出现在发现广场列表中
+    if note.status == "public":
+        invalidate_public_cache(note.user_id)
     
     # 获取点赞总数
-    like_count = session.exec(
-        select(Like).where(Like.note_id == note_id)
-    ).all()
-    like_count = len(like_count)
+    like_count = count_note_records(session, Like, note_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": action,
         "data": {
             "is_liked": is_liked,
             "like_count": like_count
         }
-    }
+    })
 
 
-@app.get("/api/notes/{note_id}/likes", response_model=dict)
+@app.get("/api/notes/{note_id}/likes")
 def get_like_count(
     note_id: int,
     current_user: Optional[User] = Depends(get_current_user_optional),
@@ -1676,37 +2201,30 @@ def get_like_count(
     - 点赞数和当前用户是否已点赞
     """
     # 检查笔记是否存在
-    note = session.get(Note, note_id)
-    if not note:
+    if not note_exists(session, note_id):
         raise HTTPException(status_code=404, detail="笔记不存在")
     
     # 获取点赞总数
-    likes = session.exec(
-        select(Like).where(Like.note_id == note_id)
-    ).all()
-    like_count = len(likes)
+    like_count = count_note_records(session, Like, note_id)
     
     # 检查当前用户是否已点赞
     is_liked = False
     if current_user:
-        existing_like = session.exec(
-            select(Like).where(Like.user_id == current_user.id).where(Like.note_id == note_id)
-        ).first()
-        is_liked = existing_like is not None
+        is_liked = find_user_note_record_id(session, Like, current_user.id, note_id) is not None
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "success",
         "data": {
             "like_count": like_count,
             "is_liked": is_liked
         }
-    }
+    })
 
 
 # ==================== 收藏相关接口 ====================
 
-@app.post("/api/notes/{note_id}/favorite", response_model=dict)
+@app.post("/api/notes/{note_id}/favorite")
 def toggle_favorite(
     note_id: int,
     current_user: User = Depends(get_current_user),
@@ -1727,46 +2245,31 @@ def toggle_favorite(
     - 操作结果和当前收藏状态
     """
     # 检查笔记是否存在
-    note = session.get(Note, note_id)
+    note = find_note_owner(session, note_id)
     if not note:
         raise HTTPException(status_code=404, detail="笔记不存在")
     
-    # 检查是否已收藏
-    existing_favorite = session.exec(
-        select(Favorite).where(Favorite.user_id == current_user.id).where(Favorite.note_id == note_id)
-    ).first()
-    
-    if existing_favorite:
-        # 已收藏，取消收藏
-        session.delete(existing_favorite)
-        session.commit()
-        is_favorited = False
-        action = "取消收藏"
-    else:
-        # 未收藏，添加收藏
-        new_favorite = Favorite(user_id=current_user.id, note_id=note_id)
-        session.add(new_favorite)
-        session.commit()
-        is_favorited = True
-        action = "收藏成功"
+    # 已收藏则取消收藏，未收藏则添加收藏
+    is_favorited = toggle_user_note_record(session, Favorite, current_user.id, note_id)
+    action = "收藏成功" if is_favorited else "取消收藏"
+    # 公开笔记的收藏数会出现在发现广场列表中
+    if note.status == "public":
+        invalidate_public_cache(note.user_id)
     
     # 获取收藏总数
-    favorites = session.exec(
-        select(Favorite).where(Favorite.note_id == note_id)
-    ).all()
-    favorite_count = len(favorites)
+    favorite_count = count_note_records(session, Favorite, note_id)
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": action,
         "data": {
             "is_favorited": is_favorited,
             "favorite_count": favorite_count
         }
-    }
+    })
 
 
-@app.get("/api/notes/{note_id}/favorites", response_model=dict)
+@app.get("/api/notes/{note_id}/favorites")
 def get_favorite_count(
     note_id: int,
     current_user: Optional[User] = Depends(get_current_user_optional),
@@ -1784,36 +2287,30 @@ def get_favorite_count(
     - 收藏数和当前用户是否已收藏
     """
     # 检查笔记是否存在
-    note = session.get(Note, note_id)
-    if not note:
+    if not note_exists(session, note_id):
         raise HTTPException(status_code=404, detail="笔记不存在")
     
     # 获取收藏总数
-    favorites = session.exec(
-        select(Favorite).where(Favorite.note_id == note_id)
-    ).all()
-    favorite_count = len(favorites)
+    favorite_count = count_note_records(session, Favorite, note_id)
     
     # 检查当前用户是否已收藏
     is_favorited = False
     if current_user:
-        existing_favorite = session.exec(
-            select(Favorite).where(Favorite.user_id == current_user.id).where(Favorite.note_id == note_id)
-        ).first()
-        is_favorited = existing_favorite is not None
+        is_favorited = find_user_note_record_id(session, Favorite, current_user.id, note_id) is not None
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "success",
         "data": {
             "favorite_count": favorite_count,
             "is_favorited": is_favorited
         }
-    }
+    })
 
 
-@app.get("/api/user/favorites", response_model=dict)
+@app.get("/api/user/favorites")
 def get_user_favorites(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     current_user: User = Depends(get_current_user),
@@ -1823,6 +2320,7 @@ def get_user_favorites(
     获取当前用户的收藏列表
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - page: 页码
     - page_size: 每页记录数
     - current_user: 当前登录用户
@@ -1834,46 +2332,49 @@ def get_user_favorites(
     offset = (page - 1) * page_size
     
     # 查询当前用户的收藏
-    statement = select(Favorite).where(Favorite.user_id == current_user.id)
-    total_statement = select(Favorite).where(Favorite.user_id == current_user.id)
+    # 通过 JOIN 在同一条查询中带出收藏的笔记和笔记作者，不需要每条收藏再分别查询笔记和作者（N+1 查询）
+    # （笔记已被删除的收藏不会出现在结果中；作者只取展示需要的列，正文只取开头用于生成预览的部分）
+    # 总数使用 SELECT COUNT(*)，只返回一个数字，不把所有收藏记录都加载到内存中
+    statement = (
+        select(
+            Note.id,
+            Note.title,
+            func.substr(Note.content, 1, CONTENT_PREVIEW_SOURCE_LENGTH).label("content"),
+            Note.published_at,
+            Note.created_at,
+            Favorite.created_at.label("favorited_at"),
+            *AUTHOR_COLUMNS,
+        )
+        .select_from(Favorite)
+        .join(Note, Note.id == Favorite.note_id)
+        .join(User, User.id == Note.user_id, isouter=True)
+        .where(Favorite.user_id == current_user.id)
+    )
+    total_statement = select(func.count()).select_from(Favorite).where(Favorite.user_id == current_user.id)
     
     # 执行分页查询，按收藏时间倒序
     favorites = session.exec(
-        statement.order_by(Favorite.created_at.desc()).offset(offset).limit(page_size)
+        statement.order_by(Favorite.created_at.desc(), Favorite.id.desc()).offset(offset).limit(page_size)
     ).all()
-    total_favorites = session.exec(total_statement).all()
-    total = len(total_favorites)
+    total = session.exec(total_statement).one()
     
     # 转换为字典格式
     favorites_list = []
     for favorite in favorites:
-        # 获取笔记信息
-        note = session.get(Note, favorite.note_id)
-        if not note:
-            continue
-        
-        # 获取作者信息
-        author = session.get(User, note.user_id)
-        
         # 提取内容预览
-        content_preview = note.content[:50] if note.content else ""
-        content_preview = re.sub(r'<[^>]+>', '', content_preview)
+        content_preview = make_content_preview(favorite.content)
         
         favorites_list.append({
-            "id": str(note.id),
-            "title": note.title,
+            "id": str(favorite.id),
+            "title": favorite.title,
             "content_preview": content_preview,
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            },
-            "published_at": note.published_at.isoformat() if note.published_at else "",
-            "created_at": note.created_at.isoformat() if note.created_at else "",
-            "favorited_at": favorite.created_at.isoformat() if favorite.created_at else "",
+            "author": build_author_info_from_row(favorite) or EMPTY_AUTHOR_INFO,
+            "published_at": favorite.published_at or "",
+            "created_at": favorite.created_at or "",
+            "favorited_at": favorite.favorited_at or "",
         })
     
-    return {
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
@@ -1882,7 +2383,7 @@ def get_user_favorites(
             "page": page,
             "page_size": page_size
         }
-    }
+    })
 
 
 # ==================== 评论相关接口 ====================
@@ -1893,7 +2394,7 @@ class CommentCreate(BaseModel):
     parent_id: Optional[int] = None  # 父评论ID，用于回复
 
 
-@app.post("/api/notes/{note_id}/comments", response_model=dict)
+@app.post("/api/notes/{note_id}/comments")
 def create_comment(
     note_id: int,
     data: CommentCreate,
@@ -1936,11 +2437,14 @@ def create_comment(
     session.add(new_comment)
     session.commit()
     session.refresh(new_comment)
+    # 公开笔记的评论数会出现在发现广场列表中
+    if note.status == "public":
+        invalidate_public_cache(note.user_id)
     
-    # 获取作者信息
-    author = session.get(User, current_user.id)
+    # 作者就是当前登录用户（认证时已加载），无需再查询一次
+    author = current_user
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "评论成功",
         "data": {
@@ -1949,18 +2453,15 @@ def create_comment(
             "note_id": str(new_comment.note_id),
             "parent_id": str(new_comment.parent_id) if new_comment.parent_id else None,
             "content": new_comment.content,
-            "created_at": new_comment.created_at.isoformat() if new_comment.created_at else "",
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            } if author else None
+            "created_at": new_comment.created_at or "",
+            "author": build_author_info(author)
         }
-    }
+    })
 
 
-@app.get("/api/notes/{note_id}/comments", response_model=dict)
+@app.get("/api/notes/{note_id}/comments")
 def get_comments(
+    request: Request,
     note_id: int,
     session: Session = Depends(get_session)
 ):
@@ -1971,6 +2472,7 @@ def get_comments(
     获取某笔记的所有评论，返回树形结构（顶级评论及其回复）
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - note_id: 笔记ID
     - session: 数据库会话
     
@@ -1978,60 +2480,65 @@ def get_comments(
     - 评论列表（树形结构）
     """
     # 检查笔记是否存在
-    note = session.get(Note, note_id)
-    if not note:
+    if not note_exists(session, note_id):
         raise HTTPException(status_code=404, detail="笔记不存在")
     
     # 获取所有评论
-    all_comments = session.exec(
-        select(Comment).where(Comment.note_id == note_id).order_by(Comment.created_at.asc())
+    # 通过 LEFT JOIN 在同一条查询中带出评论作者的展示字段，不需要每条评论再单独查询一次作者（N+1 查询）
+    rows = session.exec(
+        select(Comment, *AUTHOR_COLUMNS)
+        .join(User, User.id == Comment.user_id, isouter=True)
+        .where(Comment.note_id == note_id)
+        .order_by(Comment.created_at.asc(), Comment.id.asc())
     ).all()
     
-    # 构建评论树
+    # 构建评论树（一遍完成）
+    # 评论按时间正序排列，父评论一般在回复之前出现，回复可以直接挂到父评论的replies中；
+    # 少数父评论排在回复之后的情况（如时间相同），先记下来，遍历结束后再挂上
     comments_dict = {}
     root_comments = []
+    pending_replies = []
     
-    # 第一遍：创建所有评论的字典
-    for comment in all_comments:
-        author = session.get(User, comment.user_id)
+    for row in rows:
+        comment = row.Comment
         comment_data = {
             "id": str(comment.id),
             "user_id": str(comment.user_id),
             "note_id": str(comment.note_id),
             "parent_id": str(comment.parent_id) if comment.parent_id else None,
             "content": comment.content,
-            "created_at": comment.created_at.isoformat() if comment.created_at else "",
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            } if author else None,
+            "created_at": comment.created_at or "",
+            "author": build_author_info_from_row(row),
             "replies": []  # 子评论列表
         }
         comments_dict[comment.id] = comment_data
-    
-    # 第二遍：构建树形结构
-    for comment in all_comments:
-        comment_data = comments_dict[comment.id]
+        
         if comment.parent_id is None:
             # 顶级评论
             root_comments.append(comment_data)
-        else:
+        elif comment.parent_id in comments_dict:
             # 回复评论，添加到父评论的replies中
-            if comment.parent_id in comments_dict:
-                comments_dict[comment.parent_id]["replies"].append(comment_data)
+            comments_dict[comment.parent_id]["replies"].append(comment_data)
+        else:
+            # 父评论还没有出现，稍后再挂上
+            pending_replies.append((comment.parent_id, comment_data))
     
-    return {
+    # 父评论不存在（已被删除）的回复不显示
+    for parent_id, comment_data in pending_replies:
+        if parent_id in comments_dict:
+            comments_dict[parent_id]["replies"].append(comment_data)
+    
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
             "list": root_comments,
-            "total": len(all_comments)
+            "total": len(rows)
         }
-    }
+    }, PUBLIC_CACHE_CONTROL)
 
 
-@app.delete("/api/comments/{comment_id}", response_model=dict)
+@app.delete("/api/comments/{comment_id}")
 def delete_comment(
     comment_id: int,
     current_user: User = Depends(get_current_user),
@@ -2065,11 +2572,16 @@ def delete_comment(
     session.delete(comment)
     session.commit()
     
-    return {
+    # 公开笔记的评论数会出现在发现广场列表中
+    note = find_note_owner(session, comment.note_id)
+    if note and note.status == "public":
+        invalidate_public_cache(note.user_id)
+    
+    return ORJSONResponse(content={
         "code": 200,
         "message": "删除成功",
         "data": {}
-    }
+    })
 
 
 # ==================== 回忆瞬间相关接口 ====================
@@ -2080,7 +2592,7 @@ class MemoryMomentCreate(BaseModel):
     description: Optional[str] = None  # 描述，最多50字
 
 
-@app.post("/api/memories/upload-image", response_model=dict)
+@app.post("/api/memories/upload-image")
 async def upload_memory_image(
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user),
@@ -2110,46 +2622,47 @@ async def upload_memory_image(
         allowed_types = ["image/jpeg", "image/jpg", "image/png", "image/gif"]
         if file.content_type not in allowed_types:
             raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
+        # 检查文件内容是否真的是图片（Content-Type 可以伪造）
+        if not is_image_upload(file):
+            raise HTTPException(status_code=400, detail="只支持图片格式：jpg, jpeg, png, gif")
         
         # 检查文件大小（5MB限制）
-        file_content = await file.read()
-        if len(file_content) > 5 * 1024 * 1024:  # 5MB
+        # 不把整个文件读入内存，超过限制的文件直接拒绝
+        if get_upload_size(file) > UPLOAD_MAX_SIZE:
             raise HTTPException(status_code=400, detail="文件大小不能超过5MB")
         
-        # 生成文件名（使用用户ID和时间戳）
+        # 生成文件名（使用用户ID、时间戳和随机后缀）
+        # 本地文件名和 Cloudinary 的 public_id 使用同一个后缀
+        upload_suffix = make_upload_suffix()
         file_extension = file.filename.split(".")[-1] if "." in file.filename else "jpg"
-        filename = f"memory_{current_user.id}_{int(datetime.now().timestamp())}.{file_extension}"
+        filename = f"memory_{current_user.id}_{upload_suffix}.{file_extension}"
         
         # 检查是否配置了 Cloudinary（优先使用云存储）
-        cloudinary_cloud_name = os.getenv("CLOUDINARY_CLOUD_NAME")
-        cloudinary_api_key = os.getenv("CLOUDINARY_API_KEY")
-        cloudinary_api_secret = os.getenv("CLOUDINARY_API_SECRET")
-        
-        if cloudinary_cloud_name and cloudinary_api_key and cloudinary_api_secret:
+        if USE_CLOUDINARY:
             # ========== 使用 Cloudinary 云存储 ==========
             try:
                 # 上传到 Cloudinary
-                upload_result = cloudinary.uploader.upload(
-                    file_content,
+                # cloudinary SDK是同步的HTTPS请求，放到线程池中执行，避免阻塞事件循环（上传期间其他请求照常处理）
+                upload_result = await run_in_threadpool(
+                    cloudinary.uploader.upload,
+                    file.file,  # 直接传文件对象，不额外复制一份内容
                     folder="memories",  # 存储在 memories 文件夹下
-                    public_id=f"memory_{current_user.id}_{int(datetime.now().timestamp())}",
+                    public_id=f"memory_{current_user.id}_{upload_suffix}",
                     resource_type="image",
                     overwrite=False,
                 )
                 
                 image_url = upload_result.get("secure_url") or upload_result.get("url")
-                print(f"✅ 回忆瞬间图片已上传到 Cloudinary: {image_url}")
+                logger.info("回忆瞬间图片已上传到 Cloudinary: %s", image_url)
                 
             except Exception as cloudinary_error:
-                print(f"❌ Cloudinary 上传失败: {type(cloudinary_error).__name__}: {str(cloudinary_error)}")
-                import traceback
-                traceback.print_exc()
+                logger.exception("Cloudinary 上传失败: %s: %s", type(cloudinary_error).__name__, cloudinary_error)
                 raise HTTPException(
                     status_code=500,
                     detail=f"云存储上传失败: {str(cloudinary_error)}"
                 )
         
-        elif os.getenv("VERCEL"):
+        elif IS_VERCEL:
             raise HTTPException(
                 status_code=503,
                 detail="Vercel 环境需要配置 Cloudinary 云存储"
@@ -2161,31 +2674,28 @@ async def upload_memory_image(
             upload_dir.mkdir(parents=True, exist_ok=True)
             
             file_path = upload_dir / filename
-            with open(file_path, "wb") as buffer:
-                buffer.write(file_content)
+            await run_in_threadpool(save_upload_file, file, file_path)
             
             image_url = f"/uploads/memories/{filename}"
-            print(f"✅ 回忆瞬间图片已保存到本地: {image_url}")
+            logger.info("回忆瞬间图片已保存到本地: %s", image_url)
         
         # 注意：这里不保存到数据库，只返回图片URL
-        return {
+        return ORJSONResponse(content={
             "code": 200,
             "message": "上传成功",
             "data": {
                 "url": image_url,
                 "image": image_url
             }
-        }
+        })
     except HTTPException:
         raise
     except Exception as e:
-        print(f"上传回忆瞬间图片失败: {type(e).__name__}: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("上传回忆瞬间图片失败: %s: %s", type(e).__name__, e)
         raise HTTPException(status_code=500, detail=f"上传失败: {str(e)}")
 
 
-@app.post("/api/memories", response_model=dict)
+@app.post("/api/memories")
 def create_memory_moment(
     data: MemoryMomentCreate,
     current_user: User = Depends(get_current_user),
@@ -2219,10 +2729,10 @@ def create_memory_moment(
     session.commit()
     session.refresh(memory_moment)
     
-    # 获取作者信息
-    author = session.get(User, current_user.id)
+    # 作者就是当前登录用户（认证时已加载），无需再查询一次
+    author = current_user
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": "发布成功",
         "data": {
@@ -2230,20 +2740,17 @@ def create_memory_moment(
             "user_id": str(memory_moment.user_id),
             "image_url": memory_moment.image_url,
             "description": memory_moment.description,
-            "created_at": memory_moment.created_at.isoformat() if memory_moment.created_at else "",
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            } if author else None,
+            "created_at": memory_moment.created_at or "",
+            "author": build_author_info(author),
             "like_count": 0,
             "is_liked": False
         }
-    }
+    })
 
 
-@app.get("/api/memories", response_model=dict)
+@app.get("/api/memories")
 def get_memory_moments(
+    request: Request,
     page: int = 1,
     page_size: int = 20,
     current_user: Optional[User] = Depends(get_current_user_optional),
@@ -2256,6 +2763,7 @@ def get_memory_moments(
     获取所有回忆瞬间，按发布时间倒序排列
     
     参数：
+    - request: 请求对象（读取 If-None-Match 用于 304 协商缓存）
     - page: 页码
     - page_size: 每页记录数
     - current_user: 当前用户（可选，用于判断是否已点赞）
@@ -2267,56 +2775,57 @@ def get_memory_moments(
     offset = (page - 1) * page_size
     
     # 查询所有回忆瞬间，按创建时间倒序
-    statement = select(MemoryMoment)
-    total_statement = select(MemoryMoment)
+    # 通过 LEFT JOIN 在同一条查询中带出作者的展示字段（AUTHOR_COLUMNS），不需要每条回忆瞬间再单独查询一次作者
+    statement = (
+        select(MemoryMoment, *AUTHOR_COLUMNS)
+        .join(User, User.id == MemoryMoment.user_id, isouter=True)
+    )
     
     # 执行分页查询
-    memories = session.exec(
-        statement.order_by(MemoryMoment.created_at.desc()).offset(offset).limit(page_size)
+    rows = session.exec(
+        statement.order_by(MemoryMoment.created_at.desc(), MemoryMoment.id.desc()).offset(offset).limit(page_size)
     ).all()
-    total_memories = session.exec(total_statement).all()
-    total = len(total_memories)
-    
-    # 转换为字典格式
+    memory_ids = [row.MemoryMoment.id for row in rows]
+    # 总数由数据库 COUNT(*) 统计，不把所有回忆瞬间都加载成对象
+    total = session.exec(select(func.count()).select_from(MemoryMoment)).one()
+    
+    # 当前用户点赞过的回忆瞬间ID：一次 IN 查询查出本页中所有已点赞的ID，
+    # 序列化时用集合判断，不再为每条回忆瞬间单独查询一次
+    liked_memory_ids = set()
+    if current_user and memory_ids:
+        liked_memory_ids = set(session.exec(
+            select(MemoryMomentLike.memory_id).where(
+                MemoryMomentLike.user_id == current_user.id
+            ).where(
+                MemoryMomentLike.memory_id.in_(memory_ids)
+            )
+        ).all())
+    
+    # 本页所有回忆瞬间的点赞数：一条 GROUP BY 查询统计，{回忆瞬间ID: 点赞数}
+    like_counts = {}
+    if memory_ids:
+        like_counts = dict(session.exec(
+            select(MemoryMomentLike.memory_id, func.count())
+            .where(MemoryMomentLike.memory_id.in_(memory_ids))
+            .group_by(MemoryMomentLike.memory_id)
+        ).all())
+    
+    # 转换为字典格式（整页只需要分页、总数、点赞状态、点赞数4条查询，与每页条数无关）
     memories_list = []
-    for memory in memories:
-        # 获取作者信息
-        author = session.get(User, memory.user_id)
-        
-        # 获取点赞数
-        likes = session.exec(
-            select(MemoryMomentLike).where(MemoryMomentLike.memory_id == memory.id)
-        ).all()
-        like_count = len(likes)
-        
-        # 检查当前用户是否已点赞
-        is_liked = False
-        if current_user:
-            existing_like = session.exec(
-                select(MemoryMomentLike).where(
-                    MemoryMomentLike.user_id == current_user.id
-                ).where(
-                    MemoryMomentLike.memory_id == memory.id
-                )
-            ).first()
-            is_liked = existing_like is not None
-        
+    for row in rows:
+        memory = row.MemoryMoment
         memories_list.append({
             "id": str(memory.id),
             "user_id": str(memory.user_id),
             "image_url": memory.image_url,
             "description": memory.description,
-            "created_at": memory.created_at.isoformat() if memory.created_at else "",
-            "author": {
-                "id": str(author.id) if author else "",
-                "nickname": author.nickname if author and author.nickname else (author.username if author else ""),
-                "avatar": author.avatar if author else None,
-            } if author else None,
-            "like_count": like_count,
-            "is_liked": is_liked
+            "created_at": memory.created_at or "",
+            "author": build_author_info_from_row(row),
+            "like_count": like_counts.get(memory.id, 0),
+            "is_liked": memory.id in liked_memory_ids
         })
     
-    return {
+    return etag_response(request, {
         "code": 200,
         "message": "success",
         "data": {
@@ -2325,10 +2834,10 @@ def get_memory_moments(
             "page": page,
             "page_size": page_size
         }
-    }
+    })
 
 
-@app.post("/api/memories/{memory_id}/like", response_model=dict)
+@app.post("/api/memories/{memory_id}/like")
 def toggle_memory_like(
     memory_id: int,
     current_user: User = Depends(get_current_user),
@@ -2376,24 +2885,23 @@ def toggle_memory_like(
         is_liked = True
         action = "点赞成功"
     
-    # 获取点赞总数
-    likes = session.exec(
-        select(MemoryMomentLike).where(MemoryMomentLike.memory_id == memory_id)
-    ).all()
-    like_count = len(likes)
+    # 获取点赞总数（SELECT COUNT(*)）
+    like_count = session.exec(
+        select(func.count()).select_from(MemoryMomentLike).where(MemoryMomentLike.memory_id == memory_id)
+    ).one()
     
-    return {
+    return ORJSONResponse(content={
         "code": 200,
         "message": action,
         "data": {
             "is_liked": is_liked,
             "like_count": like_count
         }
-    }
+    })
 
 
-@app.post("/ai/editor-chat", response_model=dict)
-@app.post("/api/ai/editor-chat", response_model=dict)
+@app.post("/ai/editor-chat")
+@app.post("/api/ai/editor-chat")
 def editor_chat(
     data: AIEditorChatRequest,
     current_user: User = Depends(get_current_user)
@@ -2407,13 +2915,13 @@ def editor_chat(
     3. 代理调用 MiniMax 文本模型
     4. 仅返回 reply 给前端
     """
-    print(
-        f"🤖 AI编辑器请求: user_id={current_user.id}, "
-        f"title={data.title[:30]}, history_count={len(data.history)}"
+    logger.info(
+        "AI编辑器请求: user_id=%s, title=%s, history_count=%s",
+        current_user.id, data.title[:30], len(data.history),
     )
 
     reply = call_minimax_editor_chat(data)
-    return {"reply": reply}
+    return ORJSONResponse(content={"reply": reply})
 
 
 # ==================== 启动配置 ====================
@@ -2423,10 +2931,23 @@ if __name__ == "__main__":
     应用启动入口
     
     当直接运行此文件时（python main.py），会启动FastAPI服务器
+    （默认单进程，适合本地开发；生产环境多进程部署推荐使用 gunicorn，见 README）
     
     参数说明：
-    - app: FastAPI应用实例
+    - app: FastAPI应用（多进程时必须传 "main:app" 字符串，由每个worker进程各自导入）
     - host: 监听的主机地址，"0.0.0.0"表示监听所有网络接口
     - port: 监听端口，8080
-    """
-    uvicorn.run(app, host="0.0.0.0", port=8080)
+    - workers: worker进程数，通过 WEB_CONCURRENCY 环境变量设置（与 uvicorn/gunicorn 命令行使用的变量相同），默认1
+      每个worker有自己的数据库连接池，注意 worker数 ×（DB_POOL_SIZE + DB_MAX_OVERFLOW）不要超过数据库连接数上限
+    - loop: 事件循环实现，uvloop比默认的asyncio更快（不支持Windows，Windows下自动使用asyncio）
+    - http: HTTP协议解析器，httptools比默认的h11更快
+    """
+    workers = int(os.getenv("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        "main:app" if workers > 1 else app,
+        host="0.0.0.0",
+        port=8080,
+        workers=workers,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+    )
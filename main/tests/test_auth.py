@@ -0,0 +1,172 @@
+"""
+JWT验证测试（auth.verify_token）
+
+覆盖签名被篡改、alg替换、格式错误、过期/未生效、缺少exp等应当拒绝的情况，
+以及验证缓存命中时的过期检查
+
+运行方式（在 main 目录下）：
+python -m unittest discover tests
+"""
+import sys
+import time
+import unittest
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock
+
+import jwt
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import auth  # noqa: E402
+
+
+def make_token(payload: dict, algorithm: str = auth.ALGORITHM, key=auth.SECRET_KEY_BYTES) -> str:
+    """用指定算法和密钥签发token（绕过create_access_token，构造各种异常token）"""
+    return jwt.encode(payload, key, algorithm=algorithm)
+
+
+class VerifyTokenTest(unittest.TestCase):
+    def setUp(self):
+        auth.clear_token_cache()
+
+    def test_valid_token(self):
+        token = auth.create_access_token({"sub": "1"})
+        payload = auth.verify_token(token)
+        self.assertIsNotNone(payload)
+        self.assertEqual(payload["sub"], "1")
+
+    def test_tampered_signature(self):
+        token = auth.create_access_token({"sub": "1"})
+        header, payload, signature = token.split(".")
+        tampered = f"{header}.{payload}.{signature[:-2]}{'AA' if signature[-2:] != 'AA' else 'BB'}"
+        self.assertIsNone(auth.verify_token(tampered))
+
+    def test_tampered_payload(self):
+        token = auth.create_access_token({"sub": "1"})
+        other = auth.create_access_token({"sub": "2"})
+        header, _, signature = token.split(".")
+        forged = f"{header}.{other.split('.')[1]}.{signature}"
+        self.assertIsNone(auth.verify_token(forged))
+
+    def test_wrong_secret(self):
+        token = make_token({"sub": "1", "exp": int(time.time()) + 60}, key=b"another-secret")
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_alg_none_rejected(self):
+        token = make_token({"sub": "1", "exp": int(time.time()) + 60}, algorithm="none", key=None)
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_other_hmac_alg_rejected(self):
+        token = make_token({"sub": "1", "exp": int(time.time()) + 60}, algorithm="HS512")
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_malformed_tokens(self):
+        valid = auth.create_access_token({"sub": "1"})
+        header, payload, signature = valid.split(".")
+        for token in [
+            "",
+            "garbage",
+            "a.b",
+            "a.b.c",
+            "a.b.c.d",
+            f"{header}.{payload}",
+            f"{header}.!!!.{signature}",
+            f"{header}.{payload}.{signature}.",
+            f"{header}.{payload}.{signature}é",
+            "a" * (auth.TOKEN_MAX_LENGTH + 1),
+        ]:
+            with self.subTest(token=token[:40]):
+                self.assertIsNone(auth.verify_token(token))
+
+    def test_expired_token(self):
+        token = auth.create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=-1))
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_not_yet_valid_token(self):
+        now = int(time.time())
+        token = make_token({"sub": "1", "exp": now + 60, "nbf": now + 30})
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_token_without_exp_rejected(self):
+        token = make_token({"sub": "1"})
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_expired_token_rejected_before_signature_check(self):
+        # 已过期的token在验签前就被拒绝，签名是否正确都不会走到jwt.decode
+        expired = make_token({"sub": "1", "exp": int(time.time()) - 10}, key=b"another-secret")
+        with mock.patch.object(auth.jwt, "decode", side_effect=AssertionError("过期token不应再验签")):
+            self.assertIsNone(auth.verify_token(expired))
+
+    def test_unverified_exp_never_accepts(self):
+        # 验签前读取的exp只用于拒绝：exp未过期、但签名错误或payload无法解析的token仍然被拒绝
+        future = int(time.time()) + 60
+        header = auth.create_access_token({"sub": "1"}).split(".")[0]
+        for token in [
+            make_token({"sub": "1", "exp": future}, key=b"another-secret"),
+            f"{header}.bm90LWpzb24.c2ln",
+            f"{header}.W10.c2ln",
+        ]:
+            with self.subTest(token=token[:40]):
+                self.assertIsNone(auth.verify_token(token))
+
+    def test_rejected_token_not_cached(self):
+        token = auth.create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=-1))
+        auth.verify_token(token)
+        self.assertEqual(auth._token_cache, {})
+
+
+
+class TokenCacheTest(unittest.TestCase):
+    """验证通过的token缓存：命中时仍然检查exp，过期的条目被删除"""
+
+    def setUp(self):
+        auth.clear_token_cache()
+
+    def test_cache_hit_skips_decode(self):
+        token = auth.create_access_token({"sub": "1"})
+        self.assertIsNotNone(auth.verify_token(token))
+        self.assertEqual(len(auth._token_cache), 1)
+        with mock.patch.object(auth.jwt, "decode", side_effect=AssertionError("缓存命中时不应再次验签")):
+            self.assertEqual(auth.verify_token(token)["sub"], "1")
+
+    def test_expired_at_cache_hit(self):
+        token = auth.create_access_token({"sub": "1"}, expires_delta=timedelta(seconds=1))
+        payload = auth.verify_token(token)
+        self.assertIsNotNone(payload)
+        self.assertEqual(len(auth._token_cache), 1)
+        # 等到token过期（exp精确到秒，最多等待约1秒）：缓存中的条目必须被拒绝并删除，
+        # 之后也不会被jwt.decode重新接受、重新写入缓存
+        while time.time() <= payload["exp"]:
+            time.sleep(0.05)
+        self.assertIsNone(auth.verify_token(token))
+        self.assertEqual(auth._token_cache, {})
+        self.assertIsNone(auth.verify_token(token))
+
+    def test_cache_hit_checks_exp_before_returning(self):
+        token = auth.create_access_token({"sub": "1"})
+        payload = auth.verify_token(token)
+        # 缓存命中路径只依据缓存的exp判断：时间走到exp时不返回缓存的payload
+        with mock.patch.object(auth.time, "time", return_value=payload["exp"]), \
+                mock.patch.object(auth.jwt, "decode", side_effect=auth.jwt.ExpiredSignatureError("expired")):
+            self.assertIsNone(auth.verify_token(token))
+        self.assertEqual(auth._token_cache, {})
+
+    def test_clear_token_cache(self):
+        token = auth.create_access_token({"sub": "1"})
+        auth.verify_token(token)
+        auth.clear_token_cache()
+        self.assertEqual(auth._token_cache, {})
+
+    def test_cache_size_bounded(self):
+        with mock.patch.object(auth, "TOKEN_CACHE_MAX_SIZE", 3):
+            tokens = [auth.create_access_token({"sub": str(i)}) for i in range(5)]
+            for token in tokens:
+                self.assertIsNotNone(auth.verify_token(token))
+            self.assertEqual(len(auth._token_cache), 3)
+            # 最早的条目被淘汰，再次验证时重新验签，结果仍然正确
+            self.assertEqual(auth.verify_token(tokens[0])["sub"], "0")
+
+
+if __name__ == "__main__":
+    unittest.main()